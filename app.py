@@ -1,13 +1,26 @@
 import streamlit as st
-import google.generativeai as genai
-import json, urllib.parse, re, requests
+import json, urllib.parse, re
+import collections
+import hashlib
+import math
+import contextlib
+import contextvars
+import asyncio
+import queue
 import os
 import time
 import random
-from supabase import create_client, Client
-from concurrent.futures import ThreadPoolExecutor
-from functools import lru_cache
+import datetime
+import sqlite3
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass, asdict, field
 from streamlit.components.v1 import html
+from streamlit.errors import StreamlitAPIException
+
+# Début de cette exécution du script (mesure du premier affichage)
+SCRIPT_STARTED = time.perf_counter()
 
 # --- FONCTION DE RÉCUPÉRATION SÉCURISÉE ---
 def get_secret(key, default=""):
@@ -28,43 +41,370 @@ SUPABASE_KEY = get_secret("SUPABASE_KEY")
 TMDB_API_KEY = get_secret("TMDB_API_KEY")
 GEMINI_API_KEY = get_secret("GEMINI_API_KEY")
 
-# --- INITIALISATION ROBUSTE (CACHE ANTI-CRASH) ---
-@st.cache_resource(ttl=3600)
-def init_connections():
-    # 1. Supabase
+# Comptes autorisés à voir le panneau de diagnostic (liste séparée par des virgules)
+ADMIN_EMAILS = [e.strip().lower() for e in get_secret("ADMIN_EMAILS").split(",") if e.strip()]
+
+# Stockage local partagé (cache visuels...), commun à tous les workers d'une même machine
+DATA_DIR = get_secret("SHORTLIST_DATA_DIR", ".shortlist_cache")
+LOCAL_DB_PATH = os.path.join(DATA_DIR, "shortlist.db")
+# Vignettes servies par Streamlit (server.enableStaticServing) sous app/static/thumbs/
+THUMBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "thumbs")
+
+# --- 1bis. INSTRUMENTATION (SPANS & MÉTRIQUES) ---
+
+# Format texte Prometheus, à faire lire par le textfile collector de node_exporter. Chaque processus
+# Streamlit de la machine écrit son propre fichier (metrics.<pid>.prom), séries étiquetées process="<pid>"
+METRICS_PATH = get_secret("SHORTLIST_METRICS_PATH", os.path.join(DATA_DIR, "metrics.prom"))
+METRICS_FLUSH_INTERVAL = 15   # secondes entre deux écritures du fichier
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TRACE_HISTORY = 10            # exécutions gardées par session pour le panneau admin
+
+@st.cache_resource(show_spinner=False)
+def get_span_var():
+    return contextvars.ContextVar("shortlist_span", default=None)
+
+# Partagée entre les exécutions : les objets mis en cache gardent les globales de leur première exécution
+CURRENT_SPAN = get_span_var()
+
+@st.cache_resource(show_spinner=False)
+def get_background_var():
+    return contextvars.ContextVar("shortlist_background", default=False)
+
+# Vrai pendant un travail de fond (préchauffage) : propagé aux workers par submit_traced
+BACKGROUND_WORK = get_background_var()
+
+class Span:
+    """Mesure d'une opération ; les spans ouverts pendant celle-ci deviennent ses enfants"""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.duration = None    # None tant que l'opération tourne
+        self.error = None
+        self.children = []
+
+    def walk(self, depth=0):
+        yield depth, self
+        for child in list(self.children):
+            yield from child.walk(depth + 1)
+
+    def breakdown(self):
+        """Temps par famille (supabase, gemini, images, http, cache...). Un span imbriqué dans
+        un span de la même famille n'est pas compté deux fois."""
+        totals = collections.Counter()
+
+        def visit(node, family):
+            own = node.name.split(".")[0]
+            if own != family and node.duration is not None:
+                totals[own] += node.duration
+            for child in list(node.children):
+                visit(child, own)
+
+        for child in list(self.children):
+            visit(child, None)
+        return totals
+
+def process_metrics_path(path, pid):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{pid}{ext}"
+
+def remove_stale_metrics(path):
+    """Supprime les fichiers laissés par des processus terminés (leurs compteurs ne bougeront plus)"""
+    root, ext = os.path.splitext(path)
+    directory = os.path.dirname(path) or "."
+    prefix = os.path.basename(root) + "."
     try:
-        client_supa = create_client(SUPABASE_URL, SUPABASE_KEY)
-    except:
-        client_supa = None
-        
-    # 2. Gemini
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        pid = name[len(prefix):-len(ext)] if name.startswith(prefix) and name.endswith(ext) else ""
+        if not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+        except OSError:
+            pass  # processus vivant appartenant à un autre utilisateur
+
+class Metrics:
+    """Histogrammes de latence et compteurs d'erreurs par span, exportés périodiquement dans le
+    fichier propre au processus : les compteurs de plusieurs workers ne s'écrasent pas."""
+
+    def __init__(self, path):
+        self.pid = os.getpid()
+        self.path = process_metrics_path(path, self.pid)
+        remove_stale_metrics(path)
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.errors = collections.Counter()
+        self.last_flush = 0.0  # premier span : fichier écrit tout de suite
+
+    def observe(self, name, seconds, error=False):
+        with self.lock:
+            h = self.histograms.setdefault(name, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    h["buckets"][i] += 1
+            h["sum"] += seconds
+            h["count"] += 1
+            self.errors[name] += int(error)
+            due = time.monotonic() - self.last_flush >= METRICS_FLUSH_INTERVAL
+            if due:
+                self.last_flush = time.monotonic()
+        if due:
+            self.flush()
+
+    def render(self):
+        lines = [
+            "# HELP shortlist_span_seconds Durée des appels externes et des accès cache",
+            "# TYPE shortlist_span_seconds histogram",
+        ]
+        with self.lock:
+            for name, h in sorted(self.histograms.items()):
+                labels = f'process="{self.pid}",span="{name}"'
+                for bound, n in zip(LATENCY_BUCKETS, h["buckets"]):
+                    lines.append(f'shortlist_span_seconds_bucket{{{labels},le="{bound}"}} {n}')
+                lines.append(f'shortlist_span_seconds_bucket{{{labels},le="+Inf"}} {h["count"]}')
+                lines.append(f'shortlist_span_seconds_sum{{{labels}}} {h["sum"]:.6f}')
+                lines.append(f'shortlist_span_seconds_count{{{labels}}} {h["count"]}')
+            lines += ["# HELP shortlist_span_errors_total Spans terminés par une exception", "# TYPE shortlist_span_errors_total counter"]
+            for name, n in sorted(self.errors.items()):
+                lines.append(f'shortlist_span_errors_total{{process="{self.pid}",span="{name}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Écriture atomique (fichier temporaire puis rename) : jamais de fichier lu à moitié écrit"""
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(self.render())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Erreur export métriques : {e}")
+
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    return Metrics(METRICS_PATH)
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Chronomètre un appel externe ou un accès cache : histogramme + nœud de la trace en cours"""
+    node = Span(name, attrs)
+    parent = CURRENT_SPAN.get()
+    if parent is not None:
+        parent.children.append(node)
+    token = CURRENT_SPAN.set(node)
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        config = {
-          "temperature": 0.2,
-          "top_p": 0.95,
-          "top_k": 40,
-          "max_output_tokens": 8192,
-        }
-        client_model = genai.GenerativeModel(
-            model_name="gemini-2.5-flash",
-            generation_config=config
-        )
-    except:
-        client_model = None
+        yield node
+    except Exception as e:
+        node.error = type(e).__name__
+        raise
+    finally:
+        CURRENT_SPAN.reset(token)
+        node.duration = time.perf_counter() - node.start
+        get_metrics().observe(name, node.duration, error=node.error is not None)
+
+def traced(name):
+    """Décorateur : chaque appel de la fonction devient un span `name`"""
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__ = fn.__name__, fn.__doc__
+        return wrapper
+    return decorator
+
+def submit_traced(executor, fn, *args):
+    """executor.submit qui rattache les spans du worker au span courant"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+@contextlib.contextmanager
+def request_trace():
+    """Span racine d'une exécution du script, gardé dans la session pour le panneau admin"""
+    traces = st.session_state.setdefault('traces', collections.deque(maxlen=TRACE_HISTORY))
+    with span("rerun") as root:
+        try:
+            yield root
+        finally:
+            traces.append(root)
+
+# --- 1ter. COALESCENCE DES APPELS IDENTIQUES (SINGLE-FLIGHT) ---
 
-    return client_supa, client_model
+class EventBroadcast:
+    """File d'événements à plusieurs lecteurs : chaque abonné reçoit l'historique puis la suite"""
 
-# Chargement unique (évite l'erreur 500 au retour sur l'app)
-supabase, model = init_connections()
+    def __init__(self, on_close):
+        self.lock = threading.Lock()
+        self.history = []
+        self.subscribers = []
+        self.closed = False
+        self.on_close = on_close
+
+    def put(self, event):
+        with self.lock:
+            self.history.append(event)
+            subscribers = list(self.subscribers)
+            closing = event[0] in ("done", "error")
+            self.closed = self.closed or closing
+        for q in subscribers:
+            q.put(event)
+        if closing:
+            self.on_close()
+
+    def subscribe(self):
+        q = queue.Queue()
+        with self.lock:
+            for event in self.history:
+                q.put(event)
+            if not self.closed:
+                self.subscribers.append(q)
+        return q
+
+class SingleFlight:
+    """Appels identiques simultanés, toutes sessions du processus confondues : un seul part vers
+    l'amont, les autres attendent son résultat. Rien n'est gardé une fois l'appel terminé."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.streams = {}
+        self.calls = collections.Counter()
+        self.suppressed = collections.Counter()
+
+    def do(self, kind, key, fn, *args):
+        with self.lock:
+            future = self.inflight.get((kind, key))
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[(kind, key)] = future
+                self.calls[kind] += 1
+            else:
+                self.suppressed[kind] += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if not future.done():
+                future.set_exception(RuntimeError("appel interrompu"))
+            with self.lock:
+                self.inflight.pop((kind, key), None)
+
+    def stream(self, kind, key, start):
+        """Variante pour les pipelines à événements : `start(events)` n'est lancé que par le premier
+        demandeur, les suivants s'abonnent au même flux"""
+        with self.lock:
+            broadcast = self.streams.get((kind, key))
+            leader = broadcast is None
+            if leader:
+                broadcast = EventBroadcast(on_close=lambda: self._end_stream(kind, key))
+                self.streams[(kind, key)] = broadcast
+                self.calls[kind] += 1
+            else:
+                self.suppressed[kind] += 1
+        events = broadcast.subscribe()
+        if leader:
+            start(broadcast)
+        return events
+
+    def _end_stream(self, kind, key):
+        with self.lock:
+            self.streams.pop((kind, key), None)
+
+    def stats(self):
+        with self.lock:
+            return {kind: {"calls": self.calls[kind], "suppressed": self.suppressed[kind]} for kind in self.calls}
+
+@st.cache_resource(show_spinner=False)
+def get_single_flight():
+    return SingleFlight()
+
+# --- INITIALISATION PARESSEUSE DES CLIENTS ---
+# SDK importés et clients créés au premier appel réel, chacun de son côté : la page s'affiche
+# sans aucune connexion sortante et un backend lent ne retarde pas l'autre. Une erreur n'est
+# pas mise en cache, le prochain appel retente.
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def get_supabase():
+    with span("startup.supabase_client"):
+        from supabase import create_client
+        return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+@st.cache_resource(show_spinner=False)
+def get_genai():
+    with span("startup.genai_import"):
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        return genai
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def get_model():
+    config = {
+      "temperature": 0.2,
+      "top_p": 0.95,
+      "top_k": 40,
+      "max_output_tokens": 8192,
+    }
+    return get_genai().GenerativeModel(
+        model_name="gemini-2.5-flash",
+        generation_config=config
+    )
 
 # CONFIG PAGE (Doit être en dehors du main pour éviter les erreurs de double appel)
 st.set_page_config(page_title="The Shortlist", page_icon="3️⃣", layout="wide")
 
-# Sécurité connexion
-if not supabase or not model:
-    st.error("Erreur de connexion serveur. Veuillez rafraîchir la page.")
-    st.stop()
+# --- MESURE DU DÉMARRAGE À FROID ---
+
+def process_age():
+    """Secondes écoulées depuis le lancement du processus (Linux), None ailleurs"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except:
+        return None
+
+class StartupClock:
+    """Premier affichage à froid : celui de la toute première exécution du script du processus"""
+
+    def __init__(self, started):
+        self.started = started
+        self.cold_paint = None     # secondes depuis le début de la première exécution
+        self.cold_process = None   # secondes depuis le lancement du processus (réveil du conteneur)
+
+@st.cache_resource(show_spinner=False)
+def get_startup_clock():
+    return StartupClock(SCRIPT_STARTED)
+
+get_startup_clock()  # la première exécution du processus fixe l'origine
+
+def mark_first_paint():
+    """Temps jusqu'au premier affichage utile, une fois par session (et une fois à froid par processus)"""
+    if st.session_state.get('first_paint_ms') is not None:
+        return
+    elapsed = time.perf_counter() - SCRIPT_STARTED
+    st.session_state.first_paint_ms = 1000 * elapsed
+    get_metrics().observe("paint.session_first", elapsed)
+    clock = get_startup_clock()
+    if clock.cold_paint is None:
+        clock.cold_paint = time.perf_counter() - clock.started
+        clock.cold_process = process_age()
+        get_metrics().observe("paint.cold_start", clock.cold_process or clock.cold_paint)
 
 # --- BANQUE D'ANECDOTES POUR LE CHARGEMENT ---
 PROMO_FACTS = [
@@ -112,129 +452,1576 @@ LOADING_FACTS = {
 # --- 2. FONCTIONS DE BASE DE DONNÉES ET UTILITAIRES ---
 
 def get_ai_summary(title, author, mode):
-    """Génère un résumé flash de 3 lignes maximum"""
+    """Résumé flash de 3 lignes maximum, généré une seule fois par œuvre pour tous les utilisateurs"""
+    summary = get_summary_store().get(title, author, mode)
+    if summary is None:
+        # Le même titre demandé au même moment par plusieurs sessions : une seule génération
+        key = (normalize_title(title), normalize_title(author), mode)
+        summary = get_single_flight().do("summary", key, generate_and_store_summary, title, author, mode)
+    return summary or "Résumé indisponible pour le moment."
+
+def generate_and_store_summary(title, author, mode):
+    summary = generate_ai_summary(title, author, mode)
+    if summary:
+        get_summary_store().put(title, author, mode, summary)
+    return summary
+
+@traced("gemini.summary")
+def generate_ai_summary(title, author, mode):
+    """Génère un résumé flash de 3 lignes maximum (None en cas d'échec)"""
     media_type = "jeu vidéo" if mode == "🎮 Jeux Vidéo" else "ouvrage/média"
     prompt = f"Fais un résumé très court (maximum 3 lignes) en français pour ce {media_type} : '{title}' par '{author}'. Style direct et accrocheur."
     try:
-        response = model.generate_content(prompt)
+        response = get_model().generate_content(prompt)
+        get_token_ledger().record("summary", prompt, response)
         return response.text
     except:
-        return "Résumé indisponible pour le moment."
+        return None
+
+# --- RÉSUMÉS PARTAGÉS & PRÉCHAUFFAGE DE LA BIBLIOTHÈQUE À LA CONNEXION ---
+
+SUMMARY_TTL = 90 * 86400
+WARM_SUMMARY_LIMIT = 24      # résumés pré-générés par connexion (coups de cœur et mieux notés d'abord)
+WARM_INTERVAL = 3600         # un même compte n'est pas re-préchauffé avant ce délai
+WARM_IMAGE_LIMIT = 12        # visuels préchauffés par catégorie : la première page de la bibliothèque (LIBRARY_PAGE_SIZES[0])
+
+class SummaryStore:
+    """Résumés IA par (titre, auteur, catégorie), partagés par toutes les sessions et tous les workers"""
+
+    def __init__(self, path, ttl=SUMMARY_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = open_local_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                title_key TEXT NOT NULL,
+                author_key TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (title_key, author_key, mode)
+            )""")
+
+    @traced("cache.summary")
+    def get(self, title, author, mode):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT summary FROM summaries WHERE title_key = ? AND author_key = ? AND mode = ? AND created_at > ?",
+                (normalize_title(title), normalize_title(author), mode, time.time() - self.ttl),
+            ).fetchone()
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return row[0] if row else None
+
+    def put(self, title, author, mode, summary):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO summaries (title_key, author_key, mode, summary, created_at) VALUES (?, ?, ?, ?, ?)",
+                (normalize_title(title), normalize_title(author), mode, summary, time.time()),
+            )
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "entries": entries}
+
+@st.cache_resource(show_spinner=False)
+def get_summary_store():
+    return SummaryStore(LOCAL_DB_PATH)
+
+class LibraryWarmer:
+    """Préchauffe en arrière-plan, à la connexion, les visuels de la première page de chaque
+    catégorie puis les résumés des titres phares. Ses appels aux fournisseurs ne prennent que les
+    jetons au-delà de la réserve laissée aux demandes interactives (BACKGROUND_RESERVE) ; quand un
+    fournisseur est à court, les visuels de la catégorie sont laissés pour plus tard."""
+
+    def __init__(self, workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warmer")
+        self.lock = threading.Lock()
+        self.warmed = {}    # email -> date du dernier préchauffage
+        self.images = 0
+        self.skipped = 0
+        self.summaries = 0
+
+    def warm(self, profile):
+        with self.lock:
+            if time.time() - self.warmed.get(profile.email, 0) < WARM_INTERVAL:
+                return
+            self.warmed[profile.email] = time.time()
+        items = [(mode, g['title'], g.get('author', ''), g) for mode, games in profile.library.items() for g in games]
+        for mode, games in profile.library.items():
+            # Même ordre que la première page affichée (tri par titre)
+            for g in sorted(games, key=lambda g: g['title'].lower())[:WARM_IMAGE_LIMIT]:
+                self.executor.submit(self._warm_image, g['title'], mode)
+        # Coups de cœur puis mieux notés : ceux dont on demandera le résumé en premier
+        items.sort(key=lambda x: (not x[3].get('fav'), -(x[3].get('rating') or 0)))
+        for mode, title, author, _ in items[:WARM_SUMMARY_LIMIT]:
+            self.executor.submit(self._warm_summary, title, author, mode)
+
+    def _warm_image(self, title, mode):
+        BACKGROUND_WORK.set(True)
+        if get_artwork_cache().get(title, mode, count=False)[0]:
+            return
+        if not provider_headroom(mode):
+            with self.lock:
+                self.skipped += 1
+            return
+        try:
+            # Un worker du pool de visuels au plus par worker de préchauffage
+            get_image_resolver().submit(title, mode).result()
+            with self.lock:
+                self.images += 1
+        except Exception as e:
+            print(f"Erreur préchauffage visuel ({title}) : {e}")
+
+    def _warm_summary(self, title, author, mode):
+        BACKGROUND_WORK.set(True)
+        if get_summary_store().get(title, author, mode) is not None:
+            return
+        key = (normalize_title(title), normalize_title(author), mode)
+        if get_single_flight().do("summary", key, generate_and_store_summary, title, author, mode):
+            with self.lock:
+                self.summaries += 1
+
+    def stats(self):
+        with self.lock:
+            return {"accounts": len(self.warmed), "images": self.images, "skipped": self.skipped, "summaries": self.summaries}
+
+@st.cache_resource(show_spinner=False)
+def get_library_warmer():
+    return LibraryWarmer()
+
+# --- EXCLUSIONS (TITRES DÉJÀ VUS, REJETÉS OU EN BIBLIOTHÈQUE) ---
+
+EXCLUSION_PROMPT_LIMIT = 12   # titres exclus cités dans un prompt, quel que soit l'historique
+EXCLUSION_TTL = 180 * 86400   # un titre « vu » peut être reproposé au bout de six mois
+EXCLUSION_MAX_PER_USER = 2000 # au-delà, les exclusions locales les plus anciennes sont oubliées
+
+def title_hash(title):
+    """Empreinte 64 bits (signée, stockable en INTEGER SQLite) d'un titre normalisé"""
+    digest = hashlib.blake2b(normalize_title(title).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+class ExclusionSet:
+    """Ensemble compact d'empreintes de titres : test d'appartenance en O(1), 8 octets par titre.
+    Seuls les derniers titres sont gardés en clair, pour les citer dans les prompts."""
+
+    def __init__(self, hashes=(), recent=()):
+        self.hashes = set(hashes)
+        self.recent = collections.deque(recent, maxlen=50)  # (catégorie, titre)
+
+    def __contains__(self, title):
+        return title_hash(title) in self.hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, title, mode=None, remember=True):
+        self.hashes.add(title_hash(title))
+        if remember:
+            self.recent.append((mode, title))
+
+    def merge(self, other):
+        if other:
+            self.hashes |= other.hashes
+            self.recent.extend(other.recent)
+
+    def union(self, titles):
+        """Copie augmentée de quelques titres (ex : cartes affichées à l'écran)"""
+        copy = ExclusionSet(self.hashes, self.recent)
+        for title in titles:
+            copy.add(title, remember=False)
+        return copy
+
+    def titles(self):
+        return [title for _, title in self.recent]
+
+    def fingerprint(self):
+        """Identique pour deux ensembles de mêmes titres (coalescence des générations)"""
+        return hash(frozenset(self.hashes))
+
+    def prompt_titles(self, mode, limit=EXCLUSION_PROMPT_LIMIT):
+        """Les exclusions les plus récentes de la catégorie : seule partie injectée dans les prompts"""
+        picked = []
+        for m, title in reversed(self.recent):
+            if m in (mode, None) and title not in picked:
+                picked.append(title)
+            if len(picked) >= limit:
+                break
+        return picked
+
+class ExclusionStore:
+    """Persistance locale des exclusions de chaque utilisateur (empreintes + dernier titre en clair).
+    Propre à chaque machine (fichier SQLite, pas le profil Supabase) : un autre serveur ne connaît pas
+    les titres « vus » ici. Bornée par EXCLUSION_TTL et EXCLUSION_MAX_PER_USER, purgée au chargement."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = open_local_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_exclusions (
+                email TEXT NOT NULL,
+                title_hash INTEGER NOT NULL,
+                mode TEXT,
+                title TEXT NOT NULL,
+                added_at REAL NOT NULL,
+                PRIMARY KEY (email, title_hash)
+            )""")
+
+    @traced("cache.exclusions")
+    def load(self, email):
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM user_exclusions WHERE email = ? AND (added_at < ? OR title_hash IN ("
+                "SELECT title_hash FROM user_exclusions WHERE email = ? ORDER BY added_at DESC LIMIT -1 OFFSET ?))",
+                (email, time.time() - EXCLUSION_TTL, email, EXCLUSION_MAX_PER_USER),
+            )
+            hashes = [h for (h,) in self.conn.execute("SELECT title_hash FROM user_exclusions WHERE email = ?", (email,))]
+            recent = self.conn.execute(
+                "SELECT mode, title FROM user_exclusions WHERE email = ? ORDER BY added_at DESC LIMIT 50", (email,)
+            ).fetchall()
+        return ExclusionSet(hashes, reversed(recent))
+
+    def add(self, email, mode, title):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO user_exclusions (email, title_hash, mode, title, added_at) VALUES (?, ?, ?, ?, ?)",
+                (email, title_hash(title), mode, title, time.time()),
+            )
+
+@st.cache_resource(show_spinner=False)
+def get_exclusion_store():
+    return ExclusionStore(LOCAL_DB_PATH)
+
+def get_exclusions():
+    """Exclusions de l'utilisateur connecté (profil), sinon celles de la session anonyme"""
+    if st.session_state.get('user_email'):
+        return get_user_profile(st.session_state.user_email).exclusions
+    if st.session_state.get('exclusions') is None:
+        st.session_state.exclusions = ExclusionSet()
+    return st.session_state.exclusions
+
+def mark_seen(title, mode):
+    """Ce titre ne sera plus proposé à cet utilisateur (persisté s'il est connecté)"""
+    get_exclusions().add(title, mode)
+    if st.session_state.get('user_email'):
+        get_exclusion_store().add(st.session_state.user_email, mode, title)
+
+# --- PROFIL UTILISATEUR (CHARGÉ UNE FOIS PAR SESSION) ---
+
+class UserProfile:
+    """Bibliothèque de toutes les catégories + rejets récents, gardés en mémoire de session.
+    Les fonctions d'écriture le tiennent à jour : les reruns ne refont aucun appel Supabase."""
+
+    def __init__(self, email, library, dislikes, exclusions, complete=True):
+        self.email = email
+        self.complete = complete    # False si une lecture Supabase a échoué : rechargé au prochain rerun
+        self.run = SCRIPT_STARTED   # exécution du script qui l'a chargé
+        self.library = library      # {catégorie: [{'title', 'author', 'rating', 'fav'}]}
+        self.dislikes = dislikes    # titres rejetés ces 14 derniers jours
+        self.exclusions = exclusions  # ExclusionSet : rejets, vus et bibliothèque
+        self.version = 0            # incrémenté à chaque modification
+        self.stats = {}             # {catégorie: LibraryStats} calculées au premier affichage
+        self.tastes = {}            # {catégorie: (version, TasteProfile)}
+
+    def find(self, mode, title):
+        return next((g for g in self.library.get(mode, []) if g['title'] == title), None)
+
+    def touch(self):
+        self.version += 1
+
+    def taste(self, mode):
+        """Profil de goûts de la catégorie, recalculé seulement quand la bibliothèque a changé"""
+        cached = self.tastes.get(mode)
+        if cached is None or cached[0] != self.version:
+            cached = (self.version, TasteProfile.from_items(self.library.get(mode, [])))
+            self.tastes[mode] = cached
+        return cached[1]
+
+    def record_change(self, mode, before, after):
+        """Répercute un ajout / une modification / une suppression (déjà appliqué à `library`)
+        sur les compteurs de la catégorie, sans reparcourir toute la bibliothèque"""
+        self.touch()
+        stats = self.stats.get(mode)
+        if stats is not None and not stats.apply(before, after):
+            stats.top_favs = top_favourites(self.library.get(mode, []))
+
+def fetch_user_profile(email, days=14):
+    """Les trois lectures Supabase du profil, lancées en parallèle"""
+    limit_date = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+
+    @traced("supabase.profile_games")
+    def games():
+        res = get_supabase().table("user_library").select("game_title, game_studio, rating, is_favorite").eq("user_email", email).execute()
+        return [{'title': d['game_title'], 'author': d.get('game_studio', ''), 'rating': d['rating'], 'fav': d.get('is_favorite', False), 'category': "🎮 Jeux Vidéo"} for d in res.data]
+
+    @traced("supabase.profile_media")
+    def media():
+        res = get_supabase().table("user_media").select("title, author, rating, is_favorite, category").eq("user_email", email).execute()
+        return [{'title': d['title'], 'author': d.get('author', ''), 'rating': d['rating'], 'fav': d.get('is_favorite', False), 'category': d['category']} for d in res.data]
+
+    @traced("supabase.profile_dislikes")
+    def dislikes():
+        res = get_supabase().table("user_dislikes").select("item_title, category").eq("user_email", email).gt("created_at", limit_date).execute()
+        return [(d.get('category'), d['item_title']) for d in res.data]
+
+    def safe(fn):
+        try:
+            return fn()
+        except Exception as e:
+            print(f"Erreur chargement profil ({fn.__name__}) : {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        f_games, f_media, f_dislikes = (submit_traced(executor, safe, fn) for fn in (games, media, dislikes))
+        f_exclusions = submit_traced(executor, get_exclusion_store().load, email)
+        parts = [f_games.result(), f_media.result(), f_dislikes.result()]
+        exclusions = f_exclusions.result()
+    complete = all(part is not None for part in parts)
+    game_rows, media_rows, recent_dislikes = (part or [] for part in parts)
+    rows = game_rows + media_rows
+
+    library = {}
+    for row in rows:
+        mode = row.pop('category')
+        library.setdefault(mode, []).append(row)
+        exclusions.add(row['title'], mode, remember=False)
+    for mode, title in recent_dislikes:
+        exclusions.add(title, mode)
+    return UserProfile(email, library, [title for _, title in recent_dislikes], exclusions, complete)
+
+def get_user_profile(email):
+    """Profil de la session courante, chargé au premier besoin"""
+    profile = st.session_state.get('profile')
+    # Profil incomplet (erreur Supabase passagère) : gardé pour l'exécution en cours, relu à la suivante
+    stale = profile is not None and not profile.complete and profile.run != SCRIPT_STARTED
+    if profile is None or profile.email != email or stale:
+        profile = fetch_user_profile(email)
+        # Ce qui a été vu avant la connexion reste exclu
+        profile.exclusions.merge(st.session_state.get('exclusions'))
+        st.session_state.profile = profile
+        if profile.complete:
+            get_library_warmer().warm(profile)
+    return profile
+
+def session_profile(email):
+    """Profil déjà chargé pour cet email, sans déclencher de chargement (None sinon)"""
+    profile = st.session_state.get('profile')
+    return profile if profile is not None and profile.email == email else None
+
+# --- FILE D'ÉCRITURE DIFFÉRÉE (WRITE-BEHIND) ---
+
+WRITE_MAX_ATTEMPTS = 8
+WRITE_FAILED_TTL = 86400   # durée de conservation des échecs définitifs (confirmation au prochain rerun)
+
+def library_columns(mode):
+    """(table, colonne titre, colonne auteur) selon la catégorie"""
+    if mode == "🎮 Jeux Vidéo":
+        return "user_library", "game_title", "game_studio"
+    return "user_media", "title", "author"
+
+INSERT_DEFAULTS = {"rating": 0, "is_favorite": False}  # colonnes absentes d'une ligne non fusionnée
+
+def uniform_rows(rows):
+    """Lignes complétées pour avoir toutes les mêmes colonnes : PostgREST refuse un insert groupé
+    dont les objets n'ont pas le même jeu de clés (ex : un ajout fusionné avec un favori)"""
+    columns = list(dict.fromkeys(col for row in rows for col in row))
+    return [{col: row.get(col, INSERT_DEFAULTS.get(col)) for col in columns} for row in rows]
+
+class WriteBehindQueue:
+    """Écritures Supabase journalisées sur disque puis appliquées par un worker d'arrière-plan.
+    Les notes/favoris successifs d'un même titre fusionnent en un seul UPDATE, un ajout suivi
+    d'une suppression s'annule, et les rejets sont insérés par lots."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.owner = f"{os.getpid()}-{id(self)}"
+        self.applied = 0
+        self.coalesced = 0
+        self.conn = open_local_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_writes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                email TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                title TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_try REAL NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_until REAL NOT NULL DEFAULT 0
+            )""")
+        # Échecs définitifs, sur disque : signalés même si le processus a redémarré entre-temps
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS failed_writes (
+                id INTEGER PRIMARY KEY,
+                failed_at REAL NOT NULL
+            )""")
+        self.conn.execute("DELETE FROM failed_writes WHERE failed_at < ?", (time.time() - WRITE_FAILED_TTL,))
+        threading.Thread(target=self._run, daemon=True, name="write-behind").start()
+
+    def _pending(self, op, email, mode, title):
+        # Seules les lignes qu'aucun worker n'est en train d'envoyer peuvent être fusionnées
+        return self.conn.execute(
+            "SELECT id, payload FROM pending_writes WHERE op = ? AND email = ? AND mode = ? AND title = ? AND lease_until < ? ORDER BY id DESC",
+            (op, email, mode, title, time.time()),
+        ).fetchone()
+
+    def _append(self, op, email, mode, title, payload):
+        return self.conn.execute(
+            "INSERT INTO pending_writes (op, email, mode, title, payload) VALUES (?, ?, ?, ?, ?)",
+            (op, email, mode, title, json.dumps(payload, ensure_ascii=False)),
+        ).lastrowid
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self.conn.execute("COMMIT")
+            except:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, op, email, mode, title, payload):
+        """Journalise une écriture et renvoie l'identifiant à suivre pour la confirmation"""
+        with self._transaction():
+            write_id = self._coalesce(op, email, mode, title, payload)
+        self.wake.set()
+        return write_id
+
+    def _coalesce(self, op, email, mode, title, payload):
+        if op == "update_item":
+            for target in ("insert_item", "update_item"):
+                row = self._pending(target, email, mode, title)
+                if row:
+                    merged = json.loads(row[1])
+                    merged.update(payload)
+                    self.conn.execute("UPDATE pending_writes SET payload = ? WHERE id = ?", (json.dumps(merged, ensure_ascii=False), row[0]))
+                    self.coalesced += 1
+                    return row[0]
+        elif op == "delete_item":
+            pending_insert = self._pending("insert_item", email, mode, title)
+            self.conn.execute(
+                "DELETE FROM pending_writes WHERE op IN ('insert_item', 'update_item') AND email = ? AND mode = ? AND title = ? AND lease_until < ?",
+                (email, mode, title, time.time()),
+            )
+            if pending_insert:
+                # Ajouté puis supprimé avant tout envoi : rien à écrire
+                self.coalesced += 1
+                return None
+        return self._append(op, email, mode, title, payload)
+
+    def status(self, write_ids):
+        """Répartit des identifiants suivis en (en attente, échoués) ; les autres sont confirmés"""
+        ids = [i for i in write_ids if i is not None]
+        if not ids:
+            return set(), set()
+        marks = ','.join('?' * len(ids))
+        with self.lock:
+            pending = {r[0] for r in self.conn.execute(f"SELECT id FROM pending_writes WHERE id IN ({marks})", ids)}
+            failed = {r[0] for r in self.conn.execute(f"SELECT id FROM failed_writes WHERE id IN ({marks})", ids)}
+        return pending, failed
+
+    def pending_count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0]
+
+    def _claim(self):
+        now = time.time()
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE pending_writes SET owner = ?, lease_until = ? WHERE id IN ("
+                " SELECT id FROM pending_writes WHERE next_try <= ? AND lease_until < ? ORDER BY id LIMIT 100)",
+                (self.owner, now + 30, now, now),
+            )
+            return self.conn.execute(
+                "SELECT id, op, email, mode, title, payload, attempts FROM pending_writes WHERE owner = ? AND lease_until > ? ORDER BY id",
+                (self.owner, now),
+            ).fetchall()
+
+    def _run(self):
+        while True:
+            self.wake.wait(timeout=1.0)
+            self.wake.clear()
+            try:
+                rows = self._claim()
+                if rows:
+                    self._flush(rows)
+            except Exception as e:
+                print(f"Erreur write-behind : {e}")
+
+    def _flush(self, rows):
+        blocked = set()  # un titre en échec bloque ses écritures suivantes (ordre préservé)
+        inserts, dislikes = [], []
+        for row in rows:
+            write_id, op, email, mode, title, payload, attempts = row
+            if (email, mode, title) in blocked:
+                self._release([row])
+            elif op == "insert_dislike":
+                dislikes.append(row)
+            elif op == "insert_item":
+                inserts.append(row)
+            else:
+                # Les ajouts en attente partent avant toute modification qui pourrait les viser
+                self._insert_batch(inserts, blocked)
+                inserts = []
+                if (email, mode, title) in blocked:
+                    self._release([row])
+                    continue
+                try:
+                    apply_write(op, email, mode, title, json.loads(payload))
+                    self._done([row])
+                except Exception as e:
+                    blocked.add((email, mode, title))
+                    self._retry([row], e)
+        self._insert_batch(inserts, blocked)
+        self._insert_batch(dislikes, blocked)
+
+    def _insert_batch(self, rows, blocked):
+        """Une seule requête d'insertion par table ; en cas d'échec, ligne par ligne"""
+        by_table = {}
+        for row in rows:
+            table = "user_dislikes" if row[1] == "insert_dislike" else library_columns(row[3])[0]
+            by_table.setdefault(table, []).append(row)
+        for table, batch in by_table.items():
+            try:
+                with span("supabase.insert_batch"):
+                    get_supabase().table(table).insert(uniform_rows([json.loads(r[5]) for r in batch])).execute()
+                self._done(batch)
+                continue
+            except Exception as e:
+                if len(batch) == 1:
+                    blocked.add(tuple(batch[0][2:5]))
+                    self._retry(batch, e)
+                    continue
+            for row in batch:
+                self._insert_batch([row], blocked)
+
+    def _done(self, rows):
+        with self.lock:
+            self.conn.executemany("DELETE FROM pending_writes WHERE id = ?", [(r[0],) for r in rows])
+            self.applied += len(rows)
+
+    def _release(self, rows):
+        with self.lock:
+            self.conn.executemany("UPDATE pending_writes SET lease_until = 0 WHERE id = ?", [(r[0],) for r in rows])
+
+    def _retry(self, rows, error):
+        print(f"Erreur écriture Supabase ({len(rows)} ligne(s)) : {error}")
+        with self.lock:
+            for r in rows:
+                attempts = r[6] + 1
+                if attempts >= WRITE_MAX_ATTEMPTS:
+                    self.conn.execute("INSERT OR REPLACE INTO failed_writes (id, failed_at) VALUES (?, ?)", (r[0], time.time()))
+                    self.conn.execute("DELETE FROM pending_writes WHERE id = ?", (r[0],))
+                else:
+                    self.conn.execute(
+                        "UPDATE pending_writes SET attempts = ?, next_try = ?, lease_until = 0 WHERE id = ?",
+                        (attempts, time.time() + min(60, 2 ** attempts), r[0]),
+                    )
+
+    def stats(self):
+        with self.lock:
+            failed = self.conn.execute("SELECT COUNT(*) FROM failed_writes").fetchone()[0]
+        return {"pending": self.pending_count(), "applied": self.applied, "coalesced": self.coalesced, "failed": failed}
+
+@traced("supabase.write")
+def apply_write(op, email, mode, title, payload):
+    """Exécute une écriture unitaire côté Supabase (appelée par le worker)"""
+    table, title_col, _ = library_columns(mode)
+    if op == "update_item":
+        query = get_supabase().table(table).update(payload)
+    elif op == "delete_item":
+        query = get_supabase().table(table).delete()
+    else:
+        raise ValueError(f"Opération inconnue : {op}")
+    query = query.eq("user_email", email).eq(title_col, title)
+    if table == "user_media":
+        query = query.eq("category", mode)
+    query.execute()
+
+@st.cache_resource(show_spinner=False)
+def get_write_queue():
+    return WriteBehindQueue(LOCAL_DB_PATH)
+
+def track_write(write_id):
+    """Mémorise une écriture de la session pour la confirmer au prochain rerun"""
+    if write_id is not None:
+        st.session_state.setdefault('pending_writes', []).append(write_id)
+
+def confirm_writes():
+    """Toast de confirmation (ou d'échec) pour les écritures de la session terminées depuis le dernier rerun"""
+    tracked = st.session_state.get('pending_writes', [])
+    if not tracked:
+        return
+    pending, failed = get_write_queue().status(tracked)
+    if failed:
+        st.toast("⚠️ Certaines modifications n'ont pas pu être enregistrées.")
+    elif len(pending) < len(tracked):
+        st.toast("✅ Modifications enregistrées")
+    st.session_state.pending_writes = [i for i in tracked if i in pending]
 
 def save_rejection(email, title, mode):
     """Enregistre un rejet avec la date actuelle"""
     if email:
+        profile = session_profile(email)
+        if profile:
+            profile.dislikes.append(title)
+            profile.touch()
         try:
-            supabase.table("user_dislikes").insert({
+            track_write(get_write_queue().enqueue("insert_dislike", email, mode, title, {
                 "user_email": email, 
                 "item_title": title, 
                 "category": mode
-            }).execute()
+            }))
         except: pass
 
 def toggle_favorite_db(email, mode, title, current_status):
     """Bascule le statut favori (All-time)"""
     new_status = not current_status
-    if mode == "🎮 Jeux Vidéo":
-        supabase.table("user_library").update({"is_favorite": new_status}).eq("user_email", email).eq("game_title", title).execute()
-    else:
-        supabase.table("user_media").update({"is_favorite": new_status}).eq("user_email", email).eq("title", title).eq("category", mode).execute()
+    profile = session_profile(email)
+    item = profile.find(mode, title) if profile else None
+    if item:
+        before = dict(item)
+        item['fav'] = new_status
+        profile.record_change(mode, before, item)
+    track_write(get_write_queue().enqueue("update_item", email, mode, title, {"is_favorite": new_status}))
 
-def load_data(email, mode):
-    """Charge les données incluant l'auteur/studio"""
-    try:
-        if mode == "🎮 Jeux Vidéo":
-            res = supabase.table("user_library").select("game_title, game_studio, rating, is_favorite").eq("user_email", email).execute()
-            return [{'title': d['game_title'], 'author': d.get('game_studio', ''), 'rating': d['rating'], 'fav': d.get('is_favorite', False)} for d in res.data]
-        else:
-            res = supabase.table("user_media").select("title, author, rating, is_favorite").eq("user_email", email).eq("category", mode).execute()
-            return [{'title': d['title'], 'author': d.get('author', ''), 'rating': d['rating'], 'fav': d.get('is_favorite', False)} for d in res.data]
-    except: return []
+# --- STATISTIQUES DE LA BIBLIOTHÈQUE (COMPTEURS INCRÉMENTAUX SUR LE PROFIL) ---
+
+STATS_TOP_FAVS = 5
+
+def top_favourites(items, n=STATS_TOP_FAVS):
+    """Coups de cœur les mieux notés (à note égale, l'ordre d'origine est conservé)"""
+    return sorted((g for g in items if g.get('fav')), key=lambda g: -(g.get('rating') or 0))[:n]
+
+@dataclass
+class LibraryStats:
+    """Compteurs d'une catégorie : calculés une fois depuis le profil, puis ajustés à chaque
+    écriture de la session"""
+    total: int = 0
+    favs: int = 0
+    rating_sum: int = 0
+    top_favs: list = field(default_factory=list)
+
+    @property
+    def avg_rating(self):
+        return self.rating_sum / self.total if self.total > 0 else 0
+
+    @classmethod
+    def from_items(cls, items):
+        return cls(
+            total=len(items),
+            favs=sum(1 for g in items if g.get('fav')),
+            rating_sum=sum(g.get('rating') or 0 for g in items),
+            top_favs=top_favourites(items),
+        )
+
+    def apply(self, before, after):
+        """Ajoute `after` et retire `before` (None pour un ajout / une suppression).
+        False si la liste des coups de cœur ne peut pas être tenue à jour sans les autres titres."""
+        for item, sign in ((before, -1), (after, 1)):
+            if item:
+                self.total += sign
+                self.favs += sign * bool(item.get('fav'))
+                self.rating_sum += sign * (item.get('rating') or 0)
+        title = (after or before)['title']
+        was_top = any(g['title'] == title for g in self.top_favs)
+        self.top_favs = [g for g in self.top_favs if g['title'] != title]
+        if after and after.get('fav'):
+            self.top_favs = top_favourites([dict(after)] + self.top_favs)
+        # Un coup de cœur de la liste a disparu ou baissé alors que d'autres attendent hors liste
+        lowered = not (after and after.get('fav') and (after.get('rating') or 0) >= ((before or {}).get('rating') or 0))
+        return not (was_top and lowered and self.favs > len(self.top_favs))
+
+def load_library_stats(email, mode):
+    """Statistiques de la catégorie, calculées depuis le profil déjà en mémoire (aucun appel
+    Supabase) une fois par session, puis tenues à jour par UserProfile.record_change"""
+    profile = get_user_profile(email)
+    stats = profile.stats.get(mode)
+    if stats is None:
+        stats = LibraryStats.from_items(profile.library.get(mode, []))
+        profile.stats[mode] = stats
+    return stats
+
+# --- BIBLIOTHÈQUE PAGINÉE (FILTRE, TRI ET PAGINATION SUR LE PROFIL EN MÉMOIRE) ---
+
+LIBRARY_PAGE_SIZES = [12, 24, 48]
+LIBRARY_SORTS = {
+    # libellé : (champ, décroissant) ; None = tri par titre seul
+    "Titre A → Z": (None, False),
+    "Note ↓": ("rating", True),
+    "Note ↑": ("rating", False),
+}
+
+def load_library_page(email, mode, search, sort, page, page_size):
+    """Une page de la bibliothèque : (titres, total). Filtrée, triée et découpée depuis le profil
+    déjà chargé : aucun appel Supabase, et les modifications pas encore synchronisées sont visibles."""
+    profile = get_user_profile(email)
+    needle = search.lower()
+    rows = [g for g in profile.library.get(mode, []) if needle in g['title'].lower()]
+    sort_key, desc = LIBRARY_SORTS[sort]
+    rows.sort(key=lambda g: g['title'].lower())
+    if sort_key:
+        rows.sort(key=lambda g: g.get(sort_key) or 0, reverse=desc)  # tri stable : à égalité, ordre alphabétique
+    return rows[page * page_size:(page + 1) * page_size], len(rows)
 
 def save_item(email, mode, title, author):
     """Enregistre le titre et l'auteur proprement"""
+    profile = session_profile(email)
+    if profile and not profile.find(mode, title):
+        item = {'title': title, 'author': author, 'rating': 0, 'fav': False}
+        profile.library.setdefault(mode, []).append(item)
+        profile.record_change(mode, None, item)
     if mode == "🎮 Jeux Vidéo":
-        supabase.table("user_library").insert({
+        row = {
             "user_email": email, 
             "game_title": title,
             "game_studio": author,
             "rating": 0
-        }).execute()
+        }
     else:
-        supabase.table("user_media").insert({
+        row = {
             "user_email": email, 
             "title": title, 
             "author": author,
             "category": mode, 
             "rating": 0
-        }).execute()
+        }
+    track_write(get_write_queue().enqueue("insert_item", email, mode, title, row))
 
 def update_rating_db(email, mode, title, note):
-    if mode == "🎮 Jeux Vidéo":
-        supabase.table("user_library").update({"rating": note}).eq("user_email", email).eq("game_title", title).execute()
-    else:
-        supabase.table("user_media").update({"rating": note}).eq("user_email", email).eq("title", title).eq("category", mode).execute()
+    profile = session_profile(email)
+    item = profile.find(mode, title) if profile else None
+    if item:
+        before = dict(item)
+        item['rating'] = note
+        profile.record_change(mode, before, item)
+    track_write(get_write_queue().enqueue("update_item", email, mode, title, {"rating": note}))
 
 def delete_item_db(email, mode, title):
-    if mode == "🎮 Jeux Vidéo":
-        supabase.table("user_library").delete().eq("user_email", email).eq("game_title", title).execute()
-    else:
-        supabase.table("user_media").delete().eq("user_email", email).eq("title", title).eq("category", mode).execute()
+    profile = session_profile(email)
+    item = profile.find(mode, title) if profile else None
+    if item:
+        profile.library[mode].remove(item)
+        profile.record_change(mode, item, None)
+    track_write(get_write_queue().enqueue("delete_item", email, mode, title, {}))
+
+def is_admin(email):
+    return bool(email) and email.strip().lower() in ADMIN_EMAILS
+
+def normalize_title(title):
+    """Clé canonique d'un titre : minuscules, sans accents ni ponctuation"""
+    text = unicodedata.normalize("NFKD", str(title or "")).encode("ascii", "ignore").decode("ascii")
+    text = re.sub(r"[^a-z0-9]+", " ", text.lower())
+    return " ".join(text.split())
+
+def open_local_db(path=LOCAL_DB_PATH):
+    """Connexion SQLite en mode WAL (lecteurs/écrivains concurrents entre processus)"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
 
 # --- 3. RÉCUPÉRATION DES IMAGES (HD & PRO) ---
 
-@lru_cache(maxsize=128)
+PLACEHOLDER_IMG = "https://placehold.co/400x600/1e293b/ffffff?text=Image+Non+Trouvée"
+ARTWORK_TOUCH_INTERVAL = 86400   # last_access n'est réécrit qu'une fois par jour (précision suffisante pour la LRU)
+
+class ArtworkCache:
+    """Cache disque des visuels (titre normalisé, catégorie), partagé par tous les processus.
+    TTL long pour les visuels trouvés, court pour les échecs, éviction LRU au-delà de max_entries."""
+
+    def __init__(self, path, max_entries=20000, ttl=30 * 86400, miss_ttl=6 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.conn = open_local_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS artwork (
+                title_key TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                url TEXT,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (title_key, mode)
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS artwork_lru ON artwork(last_access)")
+
+    @traced("cache.artwork")
+    def get(self, title, mode, count=True):
+        """Renvoie (trouvé, url). url vaut None pour un échec mis en cache.
+        count=False pour une relecture qui ne doit pas fausser le taux de succès."""
+        key, now = normalize_title(title), time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT url, created_at, last_access FROM artwork WHERE title_key = ? AND mode = ?", (key, mode)
+            ).fetchone()
+            ttl = self.ttl if row and row[0] else self.miss_ttl
+            if not row or now - row[1] > ttl:
+                self.misses += count
+                return False, None
+            if now - row[2] > ARTWORK_TOUCH_INTERVAL:
+                self.conn.execute(
+                    "UPDATE artwork SET last_access = ? WHERE title_key = ? AND mode = ?", (now, key, mode)
+                )
+            if row[0]:
+                self.hits += count
+            else:
+                self.negative_hits += count
+            return True, row[0]
+
+    def put(self, title, mode, url):
+        key, now = normalize_title(title), time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO artwork (title_key, mode, url, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, mode, url, now, now),
+            )
+            self.writes += 1
+            # Éviction LRU vérifiée toutes les 100 écritures pour garder put() léger
+            if self.writes % 100 == 0:
+                self.conn.execute(
+                    "DELETE FROM artwork WHERE rowid IN (SELECT rowid FROM artwork ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM artwork").fetchone()[0]
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+# Streamlit ré-exécute le script à chaque interaction : l'état partagé doit vivre dans cache_resource
+# (sans spinner, car ces ressources peuvent être créées depuis un thread d'arrière-plan)
+@st.cache_resource(show_spinner=False)
+def get_artwork_cache():
+    return ArtworkCache(LOCAL_DB_PATH)
+
+# --- CATALOGUE LOCAL (TITRES, ALIAS ET VISUELS DÉJÀ RÉSOLUS) ---
+
+CATALOG_FUZZY_THRESHOLD = 0.8
+CATALOG_RELOAD_SECONDS = 300
+
+def title_trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def title_similarity(a, b):
+    """Similarité de Dice sur les trigrammes des titres normalisés (0 à 1)"""
+    ta, tb = title_trigrams(normalize_title(a)), title_trigrams(normalize_title(b))
+    return 2 * len(ta & tb) / (len(ta) + len(tb)) if ta and tb else 0.0
+
+class CatalogIndex:
+    """Catalogue par catégorie alimenté par les réponses des fournisseurs : fiche canonique
+    (id, titre, visuel) + tous les titres déjà demandés qui y ont mené (alias). Recherche exacte
+    par alias, puis approximative par index inversé de trigrammes, entièrement en mémoire."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.modes = {}  # catégorie -> {'aliases', 'grams', 'entries', 'loaded_at'}
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.conn = open_local_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS catalog (
+                mode TEXT NOT NULL,
+                canonical_id TEXT NOT NULL,
+                title TEXT NOT NULL,
+                image_url TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (mode, canonical_id)
+            )""")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_alias (
+                mode TEXT NOT NULL,
+                alias_key TEXT NOT NULL,
+                canonical_id TEXT NOT NULL,
+                PRIMARY KEY (mode, alias_key)
+            )""")
+
+    def _index(self, mode):
+        index = self.modes.get(mode)
+        if index is None or time.time() - index['loaded_at'] > CATALOG_RELOAD_SECONDS:
+            # Rechargement périodique pour voir les ajouts des autres processus
+            index = {'aliases': {}, 'grams': collections.defaultdict(set), 'entries': {}, 'loaded_at': time.time()}
+            for cid, title, img in self.conn.execute("SELECT canonical_id, title, image_url FROM catalog WHERE mode = ?", (mode,)):
+                index['entries'][cid] = {'id': cid, 'title': title, 'img': img}
+            for alias_key, cid in self.conn.execute("SELECT alias_key, canonical_id FROM catalog_alias WHERE mode = ?", (mode,)):
+                self._add_alias(index, alias_key, cid)
+            self.modes[mode] = index
+        return index
+
+    @staticmethod
+    def _add_alias(index, alias_key, cid):
+        index['aliases'][alias_key] = cid
+        for gram in title_trigrams(alias_key):
+            index['grams'][gram].add(alias_key)
+
+    @traced("cache.catalog")
+    def lookup(self, title, mode):
+        """Fiche du catalogue pour ce titre (exacte ou approchée), ou None"""
+        key = normalize_title(title)
+        if not key:
+            return None
+        with self.lock:
+            index = self._index(mode)
+            cid = index['aliases'].get(key)
+            if cid:
+                self.exact_hits += 1
+                return index['entries'].get(cid)
+            grams = title_trigrams(key)
+            shared = collections.Counter()
+            for gram in grams:
+                shared.update(index['grams'].get(gram, ()))
+            numbers = re.findall(r"\d+", key)
+            best, best_score = None, CATALOG_FUZZY_THRESHOLD
+            for alias_key, common in shared.items():
+                score = 2 * common / (len(grams) + len(title_trigrams(alias_key)))
+                # Numéros différents = autre épisode (Dune / Dune 2) : jamais confondus
+                if score >= best_score and re.findall(r"\d+", alias_key) == numbers:
+                    best, best_score = alias_key, score
+            if best:
+                self.fuzzy_hits += 1
+                return index['entries'].get(index['aliases'][best])
+            self.misses += 1
+            return None
+
+    def record(self, query, mode, match):
+        """Mémorise la fiche renvoyée par un fournisseur, avec la requête et le titre officiel comme alias"""
+        aliases = {normalize_title(query), normalize_title(match['title'])} - {""}
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO catalog (mode, canonical_id, title, image_url, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (mode, match['id'], match['title'], match['img'], time.time()),
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO catalog_alias (mode, alias_key, canonical_id) VALUES (?, ?, ?)",
+                [(mode, a, match['id']) for a in aliases],
+            )
+            index = self._index(mode)
+            index['entries'][match['id']] = dict(match)
+            for alias_key in aliases:
+                self._add_alias(index, alias_key, match['id'])
+
+    def stats(self):
+        lookups = self.exact_hits + self.fuzzy_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.fuzzy_hits) / lookups if lookups else 0.0,
+        }
+
+@st.cache_resource(show_spinner=False)
+def get_catalog():
+    return CatalogIndex(LOCAL_DB_PATH)
+
+@traced("images.resolve")
 def fetch_image_turbo(title, mode):
-    """Version V2 : Apple Books pour les livres + RAWG/TMDB"""
+    """Visuel d'un titre : cache disque partagé, puis catalogue local (alias et titres approchés),
+    puis API du fournisseur. Appelée par ImageResolver, qui a déjà compté la consultation du cache."""
+    cache = get_artwork_cache()
+    # Relecture : le visuel a pu être mis en cache pendant l'attente dans la file du pool
+    found, url = cache.get(title, mode, count=False)
+    if found:
+        return url or PLACEHOLDER_IMG
+    entry = get_catalog().lookup(title, mode)
+    if entry and entry.get('img'):
+        cache.put(title, mode, entry['img'])
+        return entry['img']
+    # Titre demandé au même instant par plusieurs sessions : un seul appel au fournisseur. Le
+    # préchauffage a sa propre clé : une demande interactive ne rejoint jamais un appel bridé
+    key = (normalize_title(title), mode, BACKGROUND_WORK.get())
+    return get_single_flight().do("image", key, resolve_image_remote, title, mode)
+
+def resolve_image_remote(title, mode):
+    """Interroge le fournisseur puis alimente le catalogue et le cache (les échecs réseau ne sont pas mis en cache)"""
+    cache = get_artwork_cache()
     try:
-        t_out = 3 
-        # --- 1. JEUX VIDÉO (RAWG) ---
-        if mode == "🎮 Jeux Vidéo":
-            url = f"https://api.rawg.io/api/games?key=aaa189410c114919ab95e6a90ada62f1&search={urllib.parse.quote(title)}&page_size=1"
-            r = requests.get(url, timeout=t_out).json()
-            return r['results'][0]['background_image'] if r.get('results') else None
-
-        # --- 2. FILMS & SÉRIES (TMDB) ---
-        elif mode in ["🎬 Films", "📺 Séries"]:
-            stype = "tv" if mode == "📺 Séries" else "movie"
-            url = f"https://api.themoviedb.org/3/search/{stype}?api_key={TMDB_API_KEY}&query={urllib.parse.quote(title)}"
-            r = requests.get(url, timeout=t_out).json()
-            if r.get('results') and r['results'][0].get('poster_path'):
-                return f"https://image.tmdb.org/t/p/w500{r['results'][0]['poster_path']}"
-
-        # --- 3. LIVRES (LA REVOLUTION APPLE) ---
-        elif mode == "📚 Livres":
-            try:
-                search_term = urllib.parse.quote(title)
-                apple_url = f"https://itunes.apple.com/search?term={search_term}&media=ebook&entity=ebook&limit=1"
-                r = requests.get(apple_url, timeout=2).json()
-                if r['resultCount'] > 0:
-                    img_url = r['results'][0]['artworkUrl100']
-                    return img_url.replace("100x100", "600x600")
-            except: pass 
+        with span("images.remote", title=title):
+            match = fetch_image_remote(title, mode)
+    except Exception as e:
+        # Erreur réseau : on ne met pas en cache, le prochain affichage retentera
+        print(f"Erreur Image: {e}")
+        return PLACEHOLDER_IMG
+    if match:
+        get_catalog().record(title, mode, match)
+        get_thumbnails().prefetch(match['img'])
+    url = match['img'] if match else None
+    cache.put(title, mode, url)
+    return url or PLACEHOLDER_IMG
+
+# --- VIGNETTES LOCALES (VISUELS REDIMENSIONNÉS EN WEBP, SERVIS PAR STREAMLIT) ---
 
+# Boîte maximale par emplacement (≈ 2x la hauteur affichée), proportions conservées
+THUMB_SIZES = {
+    "card": (800, 500),   # cartes de recommandation, 250 px de haut
+    "lib": (720, 360),    # grille de la bibliothèque, 180 px
+    "fav": (480, 280),    # coups de cœur, 140 px
+}
+THUMB_FAILURE_TTL = 3600
+THUMB_TOUCH_INTERVAL = 86400   # last_access n'est réécrit qu'une fois par jour (précision suffisante pour la LRU)
+
+class ThumbnailStore:
+    """Vignettes WebP nommées d'après l'empreinte de leur contenu (deux URL donnant la même image
+    partagent le fichier). L'index SQLite associe (URL d'origine, taille) au fichier ; chaque visuel
+    n'est téléchargé qu'une fois, toutes les tailles sont produites en même temps, en arrière-plan.
+    Éviction LRU au-delà de max_bytes."""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, workers=4):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+        self.lock = threading.Lock()
+        self.inflight = set()
+        self.failed = {}  # url -> instant de l'échec (pas de nouvel essai avant THUMB_FAILURE_TTL)
+        self.hits = 0
+        self.misses = 0
+        self.built = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.session = None
+        os.makedirs(directory, exist_ok=True)
+        self.conn = open_local_db()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                url TEXT NOT NULL,
+                size TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (url, size)
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS thumbnails_lru ON thumbnails(last_access)")
+
+    def lookup(self, url, size):
+        """Chemin servi par Streamlit pour cette vignette, ou None si elle n'existe pas encore"""
+        with self.lock:
+            row = self.conn.execute("SELECT digest, last_access FROM thumbnails WHERE url = ? AND size = ?", (url, size)).fetchone()
+            if row and os.path.exists(self._path(row[0])):
+                self.hits += 1
+                now = time.time()
+                if now - row[1] > THUMB_TOUCH_INTERVAL:
+                    self.conn.execute("UPDATE thumbnails SET last_access = ? WHERE url = ? AND size = ?", (now, url, size))
+                return f"app/static/thumbs/{row[0]}.webp"
+            self.misses += 1
+        return None
+
+    def prefetch(self, url):
+        """Prépare les vignettes de ce visuel en arrière-plan (sans effet si déjà faites ou en cours)"""
+        if not url or not url.startswith("http"):
+            return
+        with self.lock:
+            if url in self.inflight or time.time() - self.failed.get(url, 0) < THUMB_FAILURE_TTL:
+                return
+            self.inflight.add(url)
+        submit_traced(self.executor, self._build, url)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}.webp")
+
+    def _build(self, url):
+        try:
+            with span("images.thumbnail"):
+                with self.lock:
+                    digests = [r[0] for r in self.conn.execute("SELECT digest FROM thumbnails WHERE url = ?", (url,))]
+                # Fichiers effacés (static/ vidé, index conservé) : on reconstruit
+                if len(digests) == len(THUMB_SIZES) and all(os.path.exists(self._path(d)) for d in digests):
+                    return
+                import io
+                import requests
+                from PIL import Image
+                if self.session is None:
+                    self.session = requests.Session()
+                r = self.session.get(url, timeout=10)
+                r.raise_for_status()
+                source = Image.open(io.BytesIO(r.content))
+                source = source.convert("RGBA" if source.mode in ("RGBA", "LA", "P") else "RGB")
+                rows = []
+                for size, box in THUMB_SIZES.items():
+                    thumb = source.copy()
+                    thumb.thumbnail(box, Image.LANCZOS)
+                    out = io.BytesIO()
+                    thumb.save(out, "WEBP", quality=80, method=4)
+                    data = out.getvalue()
+                    digest = hashlib.sha256(data).hexdigest()[:32]
+                    path = self._path(digest)
+                    if not os.path.exists(path):
+                        tmp = f"{path}.{threading.get_ident()}.tmp"
+                        with open(tmp, "wb") as f:
+                            f.write(data)
+                        os.replace(tmp, path)
+                    rows.append((url, size, digest, len(data), time.time()))
+            with self.lock:
+                self.conn.executemany("INSERT OR REPLACE INTO thumbnails (url, size, digest, bytes, last_access) VALUES (?, ?, ?, ?, ?)", rows)
+                self.built += 1
+                self.bytes_in += len(r.content)
+                self.bytes_out += sum(row[3] for row in rows)
+                self._evict()
+        except Exception as e:
+            print(f"Erreur vignette ({url}) : {e}")
+            with self.lock:
+                self.failed[url] = time.time()
+        finally:
+            with self.lock:
+                self.inflight.discard(url)
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM thumbnails").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, size, digest, nbytes in self.conn.execute("SELECT url, size, digest, bytes FROM thumbnails ORDER BY last_access").fetchall():
+            self.conn.execute("DELETE FROM thumbnails WHERE url = ? AND size = ?", (url, size))
+            # Fichier partagé par contenu : supprimé seulement quand plus aucune entrée n'y renvoie
+            if not self.conn.execute("SELECT 1 FROM thumbnails WHERE digest = ?", (digest,)).fetchone():
+                with contextlib.suppress(OSError):
+                    os.remove(self._path(digest))
+            total -= nbytes
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self.lock:
+            files, size = self.conn.execute("SELECT COUNT(DISTINCT digest), COALESCE(SUM(bytes), 0) FROM thumbnails").fetchone()
+            return {
+                "hits": self.hits, "misses": self.misses, "built": self.built, "files": files, "bytes": size,
+                "saved": 1 - self.bytes_out / (self.bytes_in * len(THUMB_SIZES)) if self.bytes_in else 0.0,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_thumbnails():
+    return ThumbnailStore(THUMBS_DIR)
+
+def thumb(url, size):
+    """URL à mettre dans la carte : la vignette locale si elle est prête, sinon le visuel d'origine
+    (la vignette est alors préparée pour le prochain affichage). Sans service statique activé
+    (.streamlit/config.toml), les visuels d'origine sont gardés tels quels."""
+    if not url or not url.startswith("http") or not st.get_option("server.enableStaticServing"):
+        return url
+    store = get_thumbnails()
+    local = store.lookup(url, size)
+    if local is None:
+        store.prefetch(url)
+    return local or url
+
+# --- CLIENTS HTTP PAR FOURNISSEUR (KEEP-ALIVE + LIMITE DE DÉBIT) ---
+
+# fournisseur : (requêtes/seconde soutenues, rafale autorisée)
+PROVIDER_LIMITS = {
+    "rawg": (5, 10),
+    "tmdb": (20, 40),
+    "itunes": (20 / 60, 3),  # ~20 requêtes/minute tolérées par Apple
+    "googlebooks": (5, 10),
+    "jikan": (1, 3),         # 3 req/s et 60 req/min maximum côté Jikan
+    "steam": (0.6, 5),       # ~200 requêtes / 5 min sur la recherche du magasin
+    "tvmaze": (2, 10),       # 20 requêtes / 10 s
+    "kitsu": (3, 10),
+}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKGROUND_RESERVE = 0.5   # part de la rafale de chaque fournisseur réservée aux demandes interactives
+
+class ProviderThrottled(RuntimeError):
+    """Plus de jeton disponible pour cet appel (limite de débit ou réserve interactive)"""
+
+class ProviderCancelled(ProviderThrottled):
+    """Appel abandonné avant de partir : la requête décalée qui l'a lancé a déjà sa réponse"""
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, max_wait, reserve=0, cancel=None):
+        """Prend un jeton, en attendant au plus max_wait secondes. False si impossible.
+        Avec `reserve`, le jeton n'est pris que s'il en reste au moins `reserve` derrière ;
+        l'attente s'interrompt (False) dès que l'événement `cancel` est levé."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1 + reserve:
+                    self.tokens -= 1
+                    return True
+                wait = (1 + reserve - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                return False
+            if cancel is None:
+                time.sleep(wait)
+            elif cancel.wait(wait):
+                return False
+
+    def available(self):
+        with self.lock:
+            return min(self.capacity, self.tokens + (time.monotonic() - self.updated) * self.rate)
+
+class ProviderClient:
+    """Session requests persistante (pool keep-alive) + limite de débit + retries + métriques"""
+
+    def __init__(self, name, rate, burst, pool_size=10, max_attempts=3):
+        self.name = name
+        self.max_attempts = max_attempts
+        import requests.adapters
+        self.bucket = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0
+        self.latencies = collections.deque(maxlen=200)
+
+    def get_json(self, url, timeout, cancel=None):
+        """JSON de `url`. Avec `cancel` (requêtes décalées), une seule tentative : le fournisseur
+        suivant de la chaîne tient lieu de retry, et l'appel renonce dès que l'événement est levé."""
+        import requests
+        background = BACKGROUND_WORK.get()
+        max_attempts = 1 if cancel is not None else self.max_attempts
+        for attempt in range(max_attempts):
+            if cancel is not None and cancel.is_set():
+                raise ProviderCancelled(f"{self.name} : appel abandonné")
+            # Travail de fond : jamais d'attente, et jamais sur la réserve des demandes interactives
+            if background:
+                if not self.bucket.acquire(max_wait=0, reserve=self.bucket.capacity * BACKGROUND_RESERVE):
+                    raise ProviderThrottled(f"{self.name} : jetons réservés aux demandes interactives")
+            elif not self.bucket.acquire(max_wait=timeout, cancel=cancel):
+                if cancel is not None and cancel.is_set():
+                    raise ProviderCancelled(f"{self.name} : appel abandonné")
+                with self.lock:
+                    self.throttled += 1
+                raise ProviderThrottled(f"{self.name} : limite de débit atteinte")
+            start = time.perf_counter()
+            status, retry_after = None, None
             try:
-                g_url = f"https://www.googleapis.com/books/v1/volumes?q={urllib.parse.quote(title)}&maxResults=1"
-                r = requests.get(g_url, timeout=2).json()
-                if "items" in r:
-                    img_links = r['items'][0]['volumeInfo'].get('imageLinks', {})
-                    return img_links.get('extraLarge', img_links.get('large', img_links.get('thumbnail')))
-            except: pass
-
-        # --- 4. ANIMÉS & MANGAS (JIKAN) ---
-        elif mode in ["🧧 Animés", "🎋 Mangas"]:
-            mtype = "manga" if mode == "🎋 Mangas" else "anime"
-            url = f"https://api.jikan.moe/v4/{mtype}?q={urllib.parse.quote(title)}&limit=1"
-            r = requests.get(url, timeout=t_out).json()
-            if r.get('data'):
-                imgs = r['data'][0]['images']['jpg']
-                return imgs.get('large_image_url', imgs.get('image_url'))
+                with span(f"http.{self.name}"):
+                    r = self.session.get(url, timeout=timeout)
+                status = r.status_code
+                retry_after = r.headers.get("Retry-After")
+                if status not in RETRY_STATUSES:
+                    r.raise_for_status()
+                    return r.json()
+            except requests.ConnectionError:
+                if attempt == max_attempts - 1:
+                    self._record(start, error=True)
+                    raise
+            except Exception:
+                self._record(start, error=True)
+                raise
+            self._record(start, error=True, retry=attempt < max_attempts - 1)
+            if attempt < max_attempts - 1:
+                # Backoff exponentiel avec jitter ; Retry-After respecté mais plafonné
+                delay = 0.3 * (2 ** attempt) + random.uniform(0, 0.2)
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, min(float(retry_after), 2.0))
+                time.sleep(delay)
+        raise RuntimeError(f"{self.name} : HTTP {status} après {max_attempts} tentative(s)")
 
-    except Exception as e:
-        print(f"Erreur Image: {e}")
-        pass
-    
-    return "https://placehold.co/400x600/1e293b/ffffff?text=Image+Non+Trouvée"
+    def _record(self, start, error=False, retry=False):
+        with self.lock:
+            self.calls += 1
+            self.errors += int(error)
+            self.retries += int(retry)
+            self.latencies.append(time.perf_counter() - start)
+
+    def stats(self):
+        with self.lock:
+            lat = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "avg_ms": 1000 * sum(lat) / len(lat) if lat else 0.0,
+            "p95_ms": 1000 * lat[int(0.95 * (len(lat) - 1))] if lat else 0.0,
+        }
+
+@st.cache_resource(show_spinner=False)
+def get_provider_clients():
+    return {name: ProviderClient(name, rate, burst) for name, (rate, burst) in PROVIDER_LIMITS.items()}
+
+def provider_get(provider, url, timeout, cancel=None):
+    return get_provider_clients()[provider].get_json(url, timeout, cancel=cancel)
+
+def provider_headroom(mode):
+    """Vrai si le fournisseur de tête du mode a des jetons au-delà de la réserve interactive"""
+    chain = get_provider_ranking().order(mode)
+    if not chain:
+        return False
+    bucket = get_provider_clients()[chain[0]].bucket
+    return bucket.available() >= 1 + bucket.capacity * BACKGROUND_RESERVE
+
+class ImageResolver:
+    """Pool borné partagé par toutes les sessions : un titre déjà en cours de résolution
+    n'est jamais demandé deux fois, on réutilise le même future. Les recherches de fond
+    (préchauffage, sans attente ni réserve) sont dédoublonnées à part des demandes interactives."""
+
+    def __init__(self, max_workers=8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="artwork")
+        self.lock = threading.Lock()
+        self.inflight = {}
+
+    def submit(self, title, mode):
+        # Hit du cache disque : réponse immédiate sans passer par la file du pool
+        found, url = get_artwork_cache().get(title, mode)
+        if found:
+            done = Future()
+            done.set_result(url or PLACEHOLDER_IMG)
+            return done
+        key = (normalize_title(title), mode, BACKGROUND_WORK.get())
+        with self.lock:
+            future = self.inflight.get(key)
+            is_new = future is None
+            if is_new:
+                future = submit_traced(self.executor, fetch_image_turbo, title, mode)
+                self.inflight[key] = future
+        if is_new:
+            future.add_done_callback(lambda _, k=key: self._release(k))
+        return future
+
+    def _release(self, key):
+        with self.lock:
+            self.inflight.pop(key, None)
+
+@st.cache_resource(show_spinner=False)
+def get_image_resolver():
+    return ImageResolver()
+
+def fetch_images_batch(titles, mode):
+    """Résout tous les visuels d'une liste en parallèle : {titre: url}.
+    Le temps total est borné par la recherche la plus lente, pas par leur somme."""
+    resolver = get_image_resolver()
+    futures = {}
+    for title in titles:
+        if title not in futures:
+            futures[title] = resolver.submit(title, mode)
+    return {title: future.result() for title, future in futures.items()}
+
+def pick_best(query, results, names):
+    """Parmi les premiers résultats d'un fournisseur, celui dont le titre ressemble le plus
+    à la requête (à score égal, l'ordre du fournisseur est conservé)"""
+    if not results:
+        return None
+    scored = [(max(title_similarity(query, n) for n in names(r) if n) if any(names(r)) else 0.0, -i, r) for i, r in enumerate(results)]
+    return max(scored, key=lambda x: x[:2])[2]
+
+# --- CHAÎNES DE FOURNISSEURS DE VISUELS (HEDGING) ---
+
+def search_rawg(title, mode, timeout, cancel=None):
+    url = f"https://api.rawg.io/api/games?key=aaa189410c114919ab95e6a90ada62f1&search={urllib.parse.quote(title)}&page_size=5"
+    r = provider_get("rawg", url, timeout=timeout, cancel=cancel)
+    best = pick_best(title, [g for g in r.get('results') or [] if g.get('background_image')], lambda g: [g.get('name')])
+    if best:
+        return {'id': f"rawg:{best['id']}", 'title': best['name'], 'img': best['background_image']}
+
+def search_steam(title, mode, timeout, cancel=None):
+    url = f"https://store.steampowered.com/api/storesearch/?term={urllib.parse.quote(title)}&l=french&cc=FR"
+    r = provider_get("steam", url, timeout=timeout, cancel=cancel)
+    best = pick_best(title, (r.get('items') or [])[:5], lambda g: [g.get('name')])
+    if best:
+        return {'id': f"steam:{best['id']}", 'title': best['name'], 'img': f"https://cdn.akamai.steamstatic.com/steam/apps/{best['id']}/header.jpg"}
+
+def search_tmdb(title, mode, timeout, cancel=None):
+    stype = "tv" if mode == "📺 Séries" else "movie"
+    url = f"https://api.themoviedb.org/3/search/{stype}?api_key={TMDB_API_KEY}&query={urllib.parse.quote(title)}"
+    r = provider_get("tmdb", url, timeout=timeout, cancel=cancel)
+    candidates = [m for m in (r.get('results') or [])[:5] if m.get('poster_path')]
+    best = pick_best(title, candidates, lambda m: [m.get('title') or m.get('name'), m.get('original_title') or m.get('original_name')])
+    if best:
+        return {'id': f"tmdb:{stype}:{best['id']}", 'title': best.get('title') or best.get('name'), 'img': f"https://image.tmdb.org/t/p/w500{best['poster_path']}"}
+
+def search_tvmaze(title, mode, timeout, cancel=None):
+    r = provider_get("tvmaze", f"https://api.tvmaze.com/search/shows?q={urllib.parse.quote(title)}", timeout=timeout, cancel=cancel)
+    shows = [hit['show'] for hit in (r or [])[:5] if (hit.get('show') or {}).get('image')]
+    best = pick_best(title, shows, lambda s: [s.get('name')])
+    if best:
+        return {'id': f"tvmaze:{best['id']}", 'title': best['name'], 'img': best['image'].get('original') or best['image'].get('medium')}
+
+def search_itunes(title, mode, timeout, cancel=None):
+    # Apple Books pour les livres, iTunes Store pour les films
+    media = "movie" if mode == "🎬 Films" else "ebook"
+    url = f"https://itunes.apple.com/search?term={urllib.parse.quote(title)}&media={media}&entity={media}&limit=5"
+    r = provider_get("itunes", url, timeout=timeout, cancel=cancel)
+    best = pick_best(title, [b for b in r.get('results', []) if b.get('artworkUrl100')], lambda b: [b.get('trackName')])
+    if best:
+        return {'id': f"itunes:{best.get('trackId')}", 'title': best.get('trackName', title), 'img': best['artworkUrl100'].replace("100x100", "600x600")}
+
+def search_googlebooks(title, mode, timeout, cancel=None):
+    url = f"https://www.googleapis.com/books/v1/volumes?q={urllib.parse.quote(title)}&maxResults=5"
+    r = provider_get("googlebooks", url, timeout=timeout, cancel=cancel)
+    best = pick_best(title, [v for v in r.get('items', []) if v.get('volumeInfo', {}).get('imageLinks')], lambda v: [v['volumeInfo'].get('title')])
+    if best:
+        img_links = best['volumeInfo']['imageLinks']
+        return {'id': f"gbooks:{best.get('id')}", 'title': best['volumeInfo'].get('title', title), 'img': img_links.get('extraLarge', img_links.get('large', img_links.get('thumbnail')))}
+
+def search_jikan(title, mode, timeout, cancel=None):
+    mtype = "manga" if mode == "🎋 Mangas" else "anime"
+    url = f"https://api.jikan.moe/v4/{mtype}?q={urllib.parse.quote(title)}&limit=5"
+    r = provider_get("jikan", url, timeout=timeout, cancel=cancel)
+    best = pick_best(title, r.get('data') or [], lambda a: [a.get('title'), a.get('title_english')])
+    if best:
+        imgs = best['images']['jpg']
+        return {'id': f"mal:{mtype}:{best.get('mal_id')}", 'title': best.get('title', title), 'img': imgs.get('large_image_url', imgs.get('image_url'))}
+
+def search_kitsu(title, mode, timeout, cancel=None):
+    mtype = "manga" if mode == "🎋 Mangas" else "anime"
+    url = f"https://kitsu.io/api/edge/{mtype}?filter[text]={urllib.parse.quote(title)}&page[limit]=5"
+    r = provider_get("kitsu", url, timeout=timeout, cancel=cancel)
+    entries = [e for e in r.get('data') or [] if (e.get('attributes') or {}).get('posterImage')]
+    best = pick_best(title, entries, lambda e: [e['attributes'].get('canonicalTitle'), *(e['attributes'].get('titles') or {}).values()])
+    if best:
+        attrs = best['attributes']
+        return {'id': f"kitsu:{mtype}:{best['id']}", 'title': attrs.get('canonicalTitle', title), 'img': attrs['posterImage'].get('large') or attrs['posterImage'].get('original')}
+
+ARTWORK_PROVIDERS = {
+    "rawg": search_rawg,
+    "steam": search_steam,
+    "tmdb": search_tmdb,
+    "tvmaze": search_tvmaze,
+    "itunes": search_itunes,
+    "googlebooks": search_googlebooks,
+    "jikan": search_jikan,
+    "kitsu": search_kitsu,
+}
+
+# Ordre par défaut des fournisseurs par mode ; réordonné ensuite selon les résultats observés
+PROVIDER_CHAINS = {
+    "🎮 Jeux Vidéo": ["rawg", "steam"],
+    "🎬 Films": ["tmdb", "itunes"],
+    "📺 Séries": ["tmdb", "tvmaze"],
+    "📚 Livres": ["itunes", "googlebooks"],
+    "🧧 Animés": ["jikan", "kitsu"],
+    "🎋 Mangas": ["jikan", "kitsu"],
+}
+ARTWORK_TIMEOUT = 3   # délai maximal d'une recherche de visuel, tous fournisseurs confondus
+HEDGE_DELAY = 0.4     # sans réponse du fournisseur en cours après ce délai, le suivant part en parallèle
+
+class ProviderRanking:
+    """Taux de visuels trouvés et latence lissée par (mode, fournisseur). La chaîne est triée par
+    coût attendu (latence / taux de succès) ; sans observations, l'ordre configuré est conservé."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tries = collections.Counter()
+        self.hits = collections.Counter()
+        self.latency = {}
+
+    def call(self, provider, title, mode, cancel=None):
+        start = time.perf_counter()
+        try:
+            match = ARTWORK_PROVIDERS[provider](title, mode, ARTWORK_TIMEOUT, cancel=cancel)
+        except ProviderThrottled:
+            raise  # appel jamais parti (ou abandonné) : ne dit rien du fournisseur
+        except Exception:
+            self.record(mode, provider, False, time.perf_counter() - start)
+            raise
+        self.record(mode, provider, bool(match), time.perf_counter() - start)
+        return match
+
+    def record(self, mode, provider, hit, secs):
+        key = (mode, provider)
+        with self.lock:
+            self.tries[key] += 1
+            self.hits[key] += int(hit)
+            previous = self.latency.get(key)
+            self.latency[key] = secs if previous is None else 0.8 * previous + 0.2 * secs
+
+    def cost(self, mode, provider):
+        key = (mode, provider)
+        hit_rate = (self.hits[key] + 1) / (self.tries[key] + 2)
+        return self.latency.get(key, HEDGE_DELAY) / hit_rate
+
+    def order(self, mode):
+        with self.lock:
+            return sorted(PROVIDER_CHAINS.get(mode, []), key=lambda p: self.cost(mode, p))
+
+    def stats(self):
+        with self.lock:
+            return {
+                mode: [(p, self.hits[(mode, p)] / self.tries[(mode, p)] if self.tries[(mode, p)] else None, 1000 * self.latency.get((mode, p), 0))
+                       for p in sorted(chain, key=lambda p: self.cost(mode, p))]
+                for mode, chain in PROVIDER_CHAINS.items() if any(self.tries[(mode, p)] for p in chain)
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_provider_ranking():
+    return ProviderRanking()
+
+@st.cache_resource(show_spinner=False)
+def get_hedge_executor():
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+def fetch_image_remote(title, mode):
+    """Interroge la chaîne de fournisseurs du mode en requêtes décalées : le premier part tout de
+    suite, le suivant après HEDGE_DELAY s'il n'a pas encore répondu (ou dès qu'il a échoué).
+    Le premier visuel trouvé l'emporte ; les requêtes pas encore parties sont annulées, celles en
+    vol sont abandonnées (l'événement `cancel` leur retire retry et attente de jeton). Renvoie
+    {'id', 'title', 'img'} (fiche retenue chez le fournisseur) ou None ; lève une erreur si tous
+    les fournisseurs ont échoué ou si le délai global est dépassé."""
+    ranking = get_provider_ranking()
+    chain = ranking.order(mode)
+    pool = get_hedge_executor()
+    deadline = time.monotonic() + ARTWORK_TIMEOUT
+    cancel = threading.Event()
+    pending, errors, launched, next_launch = set(), [], 0, 0.0
+    while True:
+        if launched < len(chain) and (not pending or time.monotonic() >= next_launch):
+            pending.add(submit_traced(pool, ranking.call, chain[launched], title, mode, cancel))
+            launched += 1
+            next_launch = time.monotonic() + HEDGE_DELAY
+        if not pending:
+            break
+        until = min(deadline, next_launch) if launched < len(chain) else deadline
+        done, pending = wait(pending, timeout=max(0.0, until - time.monotonic()), return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                match = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            if match:
+                cancel.set()
+                for other in pending:
+                    other.cancel()
+                return match
+        if time.monotonic() >= deadline:
+            cancel.set()
+            for other in pending:
+                other.cancel()
+            raise TimeoutError(f"aucun visuel pour {title!r} en {ARTWORK_TIMEOUT} s")
+    # Un fournisseur jamais interrogé (faute de jeton) ne permet pas de conclure à l'absence de visuel
+    throttled = [e for e in errors if isinstance(e, ProviderThrottled)]
+    if throttled or (errors and len(errors) == launched):
+        raise (throttled or errors)[-1]
+    return None
 
 def get_smart_link(title, author, mode):
     """Génère le lien le plus RENTABLE selon la catégorie"""
@@ -251,14 +2038,1100 @@ def get_smart_link(title, author, mode):
         return f"https://www.amazon.fr/gp/video/search/ref=atv_nb_sr?phrase={query_encoded}&ie=UTF8&tag={AMAZON_PARTNER_ID}"
     return f"https://www.amazon.fr/s?k={query_encoded}&tag={AMAZON_PARTNER_ID}"
 
+def reco_card_html(item, mode):
+    """Carte d'une recommandation ; sans visuel (encore en chargement), un bloc animé le remplace"""
+    affiliate_link = get_smart_link(item['titre'], item.get('auteur', ''), mode)
+    if mode == "🎮 Jeux Vidéo":
+        btn_text = "🎮 VOIR PRIX (INSTANT GAMING)"
+        btn_color = "#FF5400"
+    elif mode in ["🎬 Films", "📺 Séries"]:
+        btn_text = "🍿 VOIR SUR PRIME VIDEO"
+        btn_color = "#00A8E1"
+    else:
+        btn_text = "🛒 VOIR SUR AMAZON"
+        btn_color = "#FF9900"
+    
+    if item.get('img'):
+        visual = f'<img src="{thumb(item["img"], "card")}" style="width:100%; height:250px; object-fit:cover; border-radius:15px;">'
+    else:
+        visual = '<div style="width:100%; height:250px; border-radius:15px; background:linear-gradient(90deg, #1e293b 25%, #334155 50%, #1e293b 75%); background-size:200% 100%; animation:card-shimmer 1.2s infinite linear;"></div><style>@keyframes card-shimmer { 0% { background-position: 200% 0; } 100% { background-position: -200% 0; } }</style>'
+    
+    badge_text = item.get('badge', '⭐ Sélection')
+    return f"""
+        <div class="game-card" style="position: relative; background: rgba(255,255,255,0.05); padding: 20px; border-radius: 15px; border: 1px solid rgba(255,255,255,0.1);">
+            <div style="position: absolute; top: 10px; right: 10px; background: #3B82F6; color: white; padding: 4px 12px; border-radius: 20px; font-size: 0.7rem; font-weight: 900; z-index: 10;">
+                {badge_text}
+            </div>
+            {visual}
+            <div style="font-weight:800; margin-top:15px; font-size:1.1rem; color:white;">{item['titre']}</div>
+            <div style="color:#3B82F6; font-size:0.8rem; font-weight:700;">{item.get('auteur', '')}</div>
+            <div style="color:rgba(255,255,255,0.6); font-size:0.85rem; margin-top:10px; height: 60px; overflow: hidden;">{item.get('desc', '')}</div>
+            <a href="{affiliate_link}" target="_blank" style="display: block; text-align: center; background: {btn_color}; color: white; text-decoration: none; padding: 12px; border-radius: 12px; margin-top: 15px; font-weight: 800; font-size: 0.9rem; box-shadow: 0 4px 6px rgba(0,0,0,0.2);">
+                {btn_text}
+            </a>
+        </div>
+    """
+
+def skeleton_card_html():
+    return """
+        <div style="background: rgba(255,255,255,0.03); padding: 20px; border-radius: 15px; border: 1px dashed rgba(255,255,255,0.1); height: 420px; display: flex; align-items: center; justify-content: center;">
+            <p style="color: #6B7280; font-weight: 700;">⚡ Recherche en cours...</p>
+        </div>
+    """
+
+# --- 3bis. PIPELINE DE RECOMMANDATION (STREAMING + VISUELS EN PARALLÈLE) ---
+
+class JsonObjectStream:
+    """Découpe un flux de texte en objets JSON complets dès leur accolade fermante"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.start = None
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        objects = []
+        while self.pos < len(self.buffer):
+            c = self.buffer[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"' and self.depth > 0:
+                self.in_string = True
+            elif c == "{":
+                if self.depth == 0:
+                    self.start = self.pos
+                self.depth += 1
+            elif c == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        objects.append(json.loads(self.buffer[self.start:self.pos + 1]))
+                    except ValueError:
+                        pass
+            self.pos += 1
+        # Hors objet, le texte déjà lu (prose, crochets, virgules) ne sert plus
+        if self.depth == 0:
+            self.buffer, self.pos = "", 0
+        return objects
+
+# --- SORTIE STRUCTURÉE (SCHÉMA JSON + VALIDATION) ---
+
+# Pas de max_output_tokens par appel : les jetons de réflexion de gemini-2.5-flash comptent dans
+# la même limite et ce SDK (google-generativeai) n'expose pas thinking_config pour les plafonner.
+# Le plafond du modèle (get_model) s'applique ; c'est le schéma qui borne la taille de la réponse.
+
+RECO_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "titre": {"type": "string"},
+        "auteur": {"type": "string"},
+        "badge": {"type": "string"},
+        "desc": {"type": "string"},
+    },
+    "required": ["titre", "auteur", "badge", "desc"],
+}
+
+def reco_list_schema(count):
+    return {"type": "array", "items": RECO_ITEM_SCHEMA, "min_items": count, "max_items": count}
+
+def structured_config(schema):
+    """generation_config imposant une réponse JSON conforme à `schema` (plus de prose autour)"""
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+@dataclass
+class Recommendation:
+    """Œuvre proposée par le modèle, une fois validée"""
+    titre: str
+    auteur: str = ""
+    badge: str = "⭐ Sélection"
+    desc: str = ""
+
+    @classmethod
+    def parse(cls, obj):
+        """Objet JSON du modèle -> Recommendation, ou None s'il est inexploitable"""
+        if not isinstance(obj, dict):
+            return None
+        fields = {}
+        for name in ("titre", "auteur", "badge", "desc"):
+            value = obj.get(name)
+            if isinstance(value, (int, float)):
+                value = str(value)
+            if value is not None and not isinstance(value, str):
+                return None
+            if value and value.strip():
+                fields[name] = value.strip()
+        if "titre" not in fields:
+            return None
+        return cls(**fields)
+
+def parse_recommendations(text, excluded=None):
+    """Réponse JSON -> œuvres validées (dicts), sans doublon ni titre exclu.
+    Une réponse tronquée (limite de jetons atteinte) garde ses objets complets."""
+    try:
+        data = json.loads(text)
+        objects = data if isinstance(data, list) else [data]
+    except ValueError:
+        objects = JsonObjectStream().feed(text)
+    recos, titles = [], set()
+    for obj in objects:
+        rec = Recommendation.parse(obj)
+        if rec is None or rec.titre in titles or (excluded is not None and rec.titre in excluded):
+            continue
+        titles.add(rec.titre)
+        recos.append(asdict(rec))
+    return recos
+
+# --- CACHE DES RÉPONSES GEMINI (EXACT + SÉMANTIQUE) ---
+
+RECO_CACHE_TTL = 24 * 3600
+# Rapprochement des requêtes voisines par embedding (un appel d'embedding par recherche)
+RECO_CACHE_SEMANTIC = get_secret("RECO_CACHE_SEMANTIC", "0") == "1"
+RECO_CACHE_SIMILARITY = 0.92
+
+class RecommendationCache:
+    """Réponses Gemini mises en commun entre utilisateurs, par (catégorie, style, plateforme, requête).
+    Les œuvres d'une même clé s'accumulent au fil des générations ; chaque lecture est filtrée
+    par les exclusions de l'utilisateur, donc les règles anti-répétition restent respectées."""
+
+    def __init__(self, path, ttl=RECO_CACHE_TTL, max_items=12):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.embeddings = collections.OrderedDict()
+        self.conn = open_local_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS reco_cache (
+                cache_key TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                items TEXT NOT NULL,
+                embedding TEXT,
+                gen_seconds REAL NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS reco_cache_scope ON reco_cache(scope)")
+
+    @staticmethod
+    def scope_of(mode, genre, platform):
+        return f"{mode}|{genre}|{platform}"
+
+    @traced("gemini.embed")
+    def embed(self, query):
+        key = normalize_title(query)
+        with self.lock:
+            cached = self.embeddings.get(key)
+        if cached is not None:
+            return cached
+        # Appel réseau hors verrou : deux sessions qui calculent la même requête au même instant
+        # font deux appels, sans autre conséquence
+        embedding = get_genai().embed_content(model="models/text-embedding-004", content=key)["embedding"]
+        with self.lock:
+            self.embeddings[key] = embedding
+            while len(self.embeddings) > 256:
+                self.embeddings.popitem(last=False)
+        return embedding
+
+    @traced("cache.reco")
+    def lookup(self, mode, genre, platform, query, excluded, count=3):
+        """Renvoie `count` œuvres absentes de `excluded` (ExclusionSet), ou None si le cache ne peut pas répondre"""
+        scope = self.scope_of(mode, genre, platform)
+        cache_key = f"{scope}|{normalize_title(query)}"
+        oldest = time.time() - self.ttl
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT items, gen_seconds FROM reco_cache WHERE cache_key = ? AND created_at > ?", (cache_key, oldest)
+            ).fetchone()
+        semantic = False
+        if row is None and RECO_CACHE_SEMANTIC:
+            row = self._nearest(scope, query, oldest)
+            semantic = row is not None
+        items = None
+        if row:
+            fresh = [i for i in json.loads(row[0]) if i["titre"] not in excluded]
+            if len(fresh) >= count:
+                items = fresh[:count]
+        with self.lock:
+            if items is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.semantic_hits += int(semantic)
+                self.saved_seconds += row[1]
+        return items
+
+    def _nearest(self, scope, query, oldest):
+        try:
+            target = self.embed(query)
+        except Exception as e:
+            print(f"Erreur embedding : {e}")
+            return None
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT items, gen_seconds, embedding FROM reco_cache WHERE scope = ? AND created_at > ? AND embedding IS NOT NULL",
+                (scope, oldest),
+            ).fetchall()
+        best, best_score = None, RECO_CACHE_SIMILARITY
+        for items, gen_seconds, embedding in rows:
+            score = cosine_similarity(target, json.loads(embedding))
+            if score >= best_score:
+                best, best_score = (items, gen_seconds), score
+        return best
+
+    def store(self, mode, genre, platform, query, recos, gen_seconds):
+        scope = self.scope_of(mode, genre, platform)
+        cache_key = f"{scope}|{normalize_title(query)}"
+        embedding = None
+        if RECO_CACHE_SEMANTIC:
+            try:
+                embedding = json.dumps(self.embed(query))
+            except Exception as e:
+                print(f"Erreur embedding : {e}")
+        new_items = [{k: v for k, v in r.items() if k != "img"} for r in recos]
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT items, created_at FROM reco_cache WHERE cache_key = ? AND created_at > ?",
+                (cache_key, time.time() - self.ttl),
+            ).fetchone()
+            items, created_at = (json.loads(row[0]), row[1]) if row else ([], time.time())
+            known = {normalize_title(i["titre"]) for i in items}
+            items += [i for i in new_items if normalize_title(i["titre"]) not in known]
+            # Le TTL court depuis la première génération : le cache se renouvelle entièrement
+            self.conn.execute(
+                "INSERT OR REPLACE INTO reco_cache (cache_key, scope, items, embedding, gen_seconds, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, scope, json.dumps(items[-self.max_items:], ensure_ascii=False), embedding, gen_seconds, created_at),
+            )
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5)
+    return dot / norm if norm else 0.0
+
+@st.cache_resource(show_spinner=False)
+def get_reco_cache():
+    return RecommendationCache(LOCAL_DB_PATH)
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop():
+    """Boucle asyncio unique, dans un thread dédié, partagée par toutes les sessions
+    (le client gRPC asynchrone de Gemini reste attaché à une seule boucle)."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="asyncio-pipeline").start()
+    return loop
+
+async def stream_recommendations(prompt, mode, events, limit=3, resolve=None, generation_config=None, excluded=None):
+    """Streame la réponse Gemini, publie chaque œuvre dès que son objet JSON est complet
+    et lance aussitôt la recherche de son visuel. `resolve` transforme un objet du modèle
+    en œuvre (None pour l'ignorer), par exemple un numéro de candidat en fiche complète."""
+    parser = JsonObjectStream()
+    image_tasks = []
+    with span("gemini.stream") as stream_span:
+        response = await get_model().generate_content_async(prompt, stream=True, generation_config=generation_config)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # morceau sans texte (fin de flux, filtre de sécurité...)
+            stream_span.attrs.setdefault("first_chunk_ms", round(1000 * (time.perf_counter() - stream_span.start)))
+            for obj in parser.feed(text):
+                if resolve and isinstance(obj, dict):
+                    obj = resolve(obj)
+                rec = Recommendation.parse(obj)
+                if len(image_tasks) >= limit or rec is None:
+                    continue
+                if excluded is not None and rec.titre in excluded:
+                    continue  # post-filtre : le modèle a ignoré une exclusion
+                obj = asdict(rec)
+                index = len(image_tasks)
+                events.put(("item", index, obj))
+                future = get_image_resolver().submit(obj["titre"], mode)
+                image_tasks.append(asyncio.ensure_future(publish_image(index, future, events)))
+        get_token_ledger().record("rerank" if resolve else "reco", prompt, response)
+    await asyncio.gather(*image_tasks)
+    events.put(("done", len(image_tasks), None))
+
+async def publish_image(index, future, events):
+    events.put(("img", index, await asyncio.wrap_future(future)))
+
+STREAM_POLL_INTERVAL = 1.0    # la boucle d'affichage se réveille au moins chaque seconde (stop / rerun)
+STREAM_STALL_TIMEOUT = 60     # sans événement pendant ce délai, le flux est considéré comme bloqué
+
+def start_recommendation_pipeline(prompt, mode, resolve=None, generation_config=None, excluded=None):
+    """Lance le pipeline en arrière-plan et renvoie la file d'événements (item / img / done / error).
+    Une génération identique déjà en cours (même prompt, mêmes exclusions) est partagée."""
+    parent = CURRENT_SPAN.get()
+
+    def start(events):
+        async def run():
+            CURRENT_SPAN.set(parent)  # la tâche tourne dans le thread de la boucle : on y rattache la trace
+            try:
+                with span("pipeline"):
+                    await stream_recommendations(prompt, mode, events, resolve=resolve, generation_config=generation_config, excluded=excluded)
+            except Exception as e:
+                events.put(("error", None, e))
+
+        asyncio.run_coroutine_threadsafe(run(), get_event_loop())
+
+    key = (mode, prompt, json.dumps(generation_config, sort_keys=True, default=str), excluded.fingerprint() if excluded else None)
+    return get_single_flight().stream("reco", key, start)
+
+def get_role_def(mode):
+    """Rôle de l'expert et libellé du champ auteur selon la catégorie"""
+    media_clean = mode.split(" ")[1]
+    if "Jeux" in mode: media_clean = "Jeux Vidéo"
+    if "Séries" in mode:
+        return "Expert en SÉRIES TV.", "le créateur (Showrunner)"
+    elif "Films" in mode:
+        return "Expert en CINÉMA.", "le réalisateur"
+    elif "Jeux" in mode:
+        return "Expert en GAMING.", "le studio"
+    return f"Expert en {media_clean}.", "l'auteur"
+
+@traced("gemini.repair")
+def repair_recommendations(recos, mode, genre, platform, query, excluded, count=3):
+    """Complète une réponse incomplète (objets invalides, réponse tronquée) sans tout régénérer :
+    d'abord depuis la réserve, sinon par un petit appel limité aux places manquantes"""
+    missing = count - len(recos)
+    if missing <= 0:
+        return recos
+    excluded = excluded.union([r['titre'] for r in recos])
+    extra = get_reco_pool().take(mode, genre, platform, excluded, count=missing)
+    if extra:
+        return recos + extra
+    role_def, author_label = get_role_def(mode)
+    known = list(dict.fromkeys([r['titre'] for r in recos] + excluded.prompt_titles(mode)))
+    repair_prompt = PromptBuilder().text(f"""
+    RÔLE : {role_def}
+    MISSION : Complète une sélection pour "{query}" (Catégorie {mode} | Style {genre}) avec {missing} œuvre(s).
+    """).items("RÈGLES : Œuvres existantes en France, pas de suites, aucune de celles-ci : {items}.", known, empty="aucune").text(f"""
+    Le champ "auteur" contient {author_label}.
+    """).build()
+    try:
+        response = get_model().generate_content(
+            repair_prompt, generation_config=structured_config(reco_list_schema(missing))
+        )
+        get_token_ledger().record("repair", repair_prompt, response)
+        extra = parse_recommendations(response.text, excluded)[:missing]
+    except Exception as e:
+        print(f"Erreur réparation de la réponse : {e}")
+        return recos
+    images = fetch_images_batch([r['titre'] for r in extra], mode)
+    for r in extra:
+        r['img'] = images[r['titre']]
+    return recos + extra
+
+# --- CONSTRUCTION DES PROMPTS (BUDGET DE JETONS & PROFIL DE GOÛTS) ---
+
+PROMPT_TOKEN_BUDGET = 700   # plafond d'un prompt de recommandation, goûts et exclusions compris
+TASTE_TOKEN_BUDGET = 120    # part maximale du profil de goûts dans ce plafond
+TASTE_MIN_WEIGHT = 4        # note ≥ 4, ou coup de cœur noté au moins 2
+
+class TokenLedger:
+    """Jetons estimés avant l'envoi et réellement consommés (usage_metadata), par type d'appel.
+    Le ratio caractères / jeton de l'estimation est recalé sur les comptes renvoyés par Gemini."""
+
+    def __init__(self, chars_per_token=3.6):
+        self.lock = threading.Lock()
+        self.chars_per_token = chars_per_token
+        self.calls = collections.Counter()
+        self.prompt_tokens = collections.Counter()
+        self.response_tokens = collections.Counter()
+
+    def estimate(self, text):
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def record(self, kind, prompt, response):
+        """Comptabilise un appel et l'inscrit sur le span en cours (trace de la requête)"""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        estimated = self.estimate(prompt)
+        with self.lock:
+            self.calls[kind] += 1
+            self.prompt_tokens[kind] += prompt_tokens
+            self.response_tokens[kind] += response_tokens
+            if prompt_tokens:
+                ratio = min(6.0, max(2.0, len(prompt) / prompt_tokens))
+                self.chars_per_token = 0.9 * self.chars_per_token + 0.1 * ratio
+        node = CURRENT_SPAN.get()
+        if node is not None:
+            node.attrs.update(prompt_tokens=prompt_tokens, response_tokens=response_tokens, estimated_tokens=estimated)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "chars_per_token": self.chars_per_token,
+                "kinds": {kind: {"calls": n, "prompt": self.prompt_tokens[kind], "response": self.response_tokens[kind]} for kind, n in self.calls.items()},
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_token_ledger():
+    return TokenLedger()
+
+def compact_prompt(text):
+    """Retire l'indentation et les lignes vides des gabarits (autant de jetons en moins)"""
+    return "\n".join(line.strip() for line in text.strip().splitlines() if line.strip())
+
+class PromptBuilder:
+    """Assemble un prompt section par section. Les sections fixes passent toujours ; les listes
+    (goûts, exclusions) sont remplies dans l'ordre où elles sont ajoutées, élément par élément,
+    tant que l'estimation reste sous le budget."""
+
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET):
+        self.budget = budget
+        self.sections = []   # (gabarit, éléments ou None, séparateur, texte si vide, plafond)
+        self.estimated = 0
+        self.dropped = 0
+
+    def text(self, template):
+        self.sections.append((compact_prompt(template), None, None, None, None))
+        return self
+
+    def items(self, template, items, sep=", ", empty="aucun", max_tokens=None):
+        """`template` contient {items} ; sans place pour le moindre élément, il reçoit `empty`"""
+        self.sections.append((compact_prompt(template), list(items), sep, empty, max_tokens))
+        return self
+
+    def build(self):
+        ledger = get_token_ledger()
+        skeleton = [t if items is None else t.replace("{items}", empty) for t, items, _, empty, _ in self.sections]
+        remaining = self.budget - ledger.estimate("\n".join(skeleton))
+        parts = []
+        for template, items, sep, empty, cap in self.sections:
+            if items is None:
+                parts.append(template)
+                continue
+            allowance = min(remaining, cap) if cap else remaining
+            kept, used = [], 0
+            for item in items:
+                cost = ledger.estimate(item + sep)
+                if used + cost > allowance:
+                    break
+                kept.append(item)
+                used += cost
+            remaining -= used
+            self.dropped += len(items) - len(kept)
+            parts.append(template.replace("{items}", sep.join(kept) if kept else empty))
+        prompt = "\n".join(parts)
+        self.estimated = ledger.estimate(prompt)
+        node = CURRENT_SPAN.get()
+        if node is not None:
+            node.attrs.update(prompt_estimate=self.estimated, prompt_dropped=self.dropped)
+        return prompt
+
+@dataclass
+class TasteProfile:
+    """Résumé compact des goûts d'une catégorie : titres et auteurs les plus appréciés, par poids
+    (note, +2 pour un coup de cœur)"""
+    titles: list = field(default_factory=list)    # ["Titre (5★ ❤️)", ...] par poids décroissant
+    authors: list = field(default_factory=list)   # auteurs / studios par poids cumulé décroissant
+
+    @classmethod
+    def from_items(cls, items):
+        weighted = [((g.get('rating') or 0) + 2 * bool(g.get('fav')), g) for g in items]
+        liked = sorted([(w, g) for w, g in weighted if w >= TASTE_MIN_WEIGHT], key=lambda x: -x[0])
+        author_weights = collections.Counter()
+        for w, g in liked:
+            if g.get('author'):
+                author_weights[g['author']] += w
+        return cls(
+            titles=[f"{g['title']} ({g.get('rating') or 0}★{' ❤️' if g.get('fav') else ''})" for _, g in liked],
+            authors=[a for a, _ in author_weights.most_common()],
+        )
+
+    def add_to(self, builder):
+        """Sections du profil, plafonnées à TASTE_TOKEN_BUDGET (deux tiers titres, un tiers auteurs)"""
+        if not self.titles:
+            return builder
+        builder.items("GOÛTS DE L'UTILISATEUR (œuvres qu'il a adorées, à prendre comme référence) : {items}.",
+                      self.titles, max_tokens=2 * TASTE_TOKEN_BUDGET // 3)
+        if self.authors:
+            builder.items("Créateurs qu'il apprécie : {items}.", self.authors, max_tokens=TASTE_TOKEN_BUDGET // 3)
+        return builder
+
+def session_taste(mode):
+    """Profil de goûts de l'utilisateur connecté (None sans profil chargé)"""
+    profile = session_profile(st.session_state.get('user_email'))
+    return profile.taste(mode) if profile else None
+
+def build_reco_prompt(mode, genre, query, exclusions, taste=None):
+    """Prompt de génération libre : 3 œuvres proches de `query` dans la catégorie `mode`"""
+    role_def, author_label = get_role_def(mode)
+    builder = PromptBuilder().text(f"""
+    RÔLE : {role_def}
+    MISSION : L'utilisateur cherche "{query}".
+    CONTEXTE : Catégorie {mode.upper()} | Style {genre}.
+    """)
+    if taste:
+        taste.add_to(builder)
+    builder.text(f"""
+    🧠 PROTOCOLE D'ANALYSE (IMPORTANT) :
+    1. Est-ce que tu connais PRÉCISÉMENT l'œuvre "{query}" ?
+        - OUI -> Propose 3 œuvres SIMILAIRES (même vibe/public) mais d'auteurs différents.
+        - NON (Titre inconnu) -> IGNORE le titre. Propose 3 pépites incontournables du genre "{genre}" qui correspondent à l'ambiance des mots-clés.
+    
+    ⛔ RÈGLES D'EXCLUSION (CRITIQUE) :
+    1. ANTI-PERROQUET : Ne propose JAMAIS le titre recherché "{query}" en résultat.
+    2. ANTI-FRANCHISE : Pas de suites, pas de spin-offs (Ex: Si recherche "Walking Dead", INTERDIT "Fear the Walking Dead").
+    3. CATÉGORIE STRICTE : Si je suis dans {mode}, ne propose RIEN d'autre (Pas de livre si je suis dans Jeux !).
+    """)
+    builder.items("4. DÉJÀ VUS : Ne propose aucun de ces titres : {items}.", exclusions.prompt_titles(mode))
+    builder.text(f"""
+    INSTRUCTIONS :
+    1. CIBLE : Si le genre est "Dark Romance", propose UNIQUEMENT de la Dark Romance (pas de policier classique !).
+    2. RÉALISME : Uniquement des œuvres existantes en France.
+    3. STRUCTURE JSON : Le champ "auteur" doit contenir {author_label}.
+    
+    FORMAT DE RÉPONSE (JSON PUR) :
+    [
+        {{
+        "titre": "Titre exact officiel",
+        "auteur": "Nom ({author_label})",
+        "badge": "Badge court (ex: Pépite, Culte)",
+        "desc": "Pourquoi c'est le choix parfait (1 phrase)."
+        }}
+    ]
+    """)
+    return builder.build()
+
+# --- 3ter. RÉSERVE DE PÉPITES PRÉ-GÉNÉRÉES ("SURPRENDS-MOI" & "PAS POUR MOI") ---
+
+POOL_LOW_WATERMARK = 9     # en dessous, une recharge est lancée en arrière-plan
+POOL_BATCH_SIZE = 12       # œuvres générées par recharge
+POOL_MAX_SERVES = 20       # une œuvre est retirée après avoir été servie autant de fois
+POOL_TTL = 7 * 86400
+
+class RecoPool:
+    """Réserve locale (SQLite) d'œuvres déjà générées et illustrées, par (catégorie, style, plateforme).
+    Servie en quelques millisecondes ; rechargée par un worker dédié sur seuil bas, jamais sur un clic."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.refilling = set()
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reco-pool")
+        self.conn = open_local_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS reco_pool (
+                scope TEXT NOT NULL,
+                title_key TEXT NOT NULL,
+                item TEXT NOT NULL,
+                served INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (scope, title_key)
+            )""")
+        # Bail de recharge : une seule recharge par scope, tous processus confondus
+        self.conn.execute("CREATE TABLE IF NOT EXISTS reco_pool_lease (scope TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    @staticmethod
+    def scope_of(mode, genre, platform):
+        return f"{mode}|{genre}|{platform}"
+
+    def _fresh_rows(self, scope):
+        return self.conn.execute(
+            "SELECT title_key, item FROM reco_pool WHERE scope = ? AND served < ? AND created_at > ? ORDER BY served, RANDOM()",
+            (scope, POOL_MAX_SERVES, time.time() - POOL_TTL),
+        ).fetchall()
+
+    @traced("cache.pool")
+    def take(self, mode, genre, platform, excluded, count):
+        """Sert `count` œuvres absentes de `excluded` (ExclusionSet), ou None si la réserve n'en a pas assez"""
+        scope = self.scope_of(mode, genre, platform)
+        with self.lock:
+            rows = self._fresh_rows(scope)
+            picked = [(key, item) for key, item in rows if key not in excluded][:count]
+            if len(picked) == count:
+                self.conn.executemany(
+                    "UPDATE reco_pool SET served = served + 1 WHERE scope = ? AND title_key = ?",
+                    [(scope, key) for key, _ in picked],
+                )
+        # Réserve trop pauvre pour cet utilisateur : on recharge aussi
+        self.ensure(mode, genre, platform, available=len(rows) if len(picked) == count else 0)
+        if len(picked) < count:
+            return None
+        return [json.loads(item) for _, item in picked]
+
+    def ensure(self, mode, genre, platform, available=None):
+        """Déclenche une recharge en arrière-plan si la réserve passe sous le seuil bas"""
+        scope = self.scope_of(mode, genre, platform)
+        if available is None:
+            with self.lock:
+                available = len(self._fresh_rows(scope))
+        if available >= POOL_LOW_WATERMARK:
+            return
+        with self.lock:
+            if scope in self.refilling:
+                return
+            self.refilling.add(scope)
+        self.worker.submit(self._refill, mode, genre, platform)
+
+    def _refill(self, mode, genre, platform):
+        scope = self.scope_of(mode, genre, platform)
+        try:
+            now = time.time()
+            with self.lock:
+                self.conn.execute("DELETE FROM reco_pool_lease WHERE expires_at < ?", (now,))
+                leased = self.conn.execute(
+                    "INSERT OR IGNORE INTO reco_pool_lease (scope, expires_at) VALUES (?, ?)", (scope, now + 120)
+                ).rowcount
+                known = [json.loads(item)["titre"] for _, item in self._fresh_rows(scope)]
+            if not leased:
+                return  # un autre processus recharge déjà ce scope
+            role_def, author_label = get_role_def(mode)
+            pool_prompt = PromptBuilder().text(f"""
+            RÔLE : {role_def}
+            MISSION : Propose {POOL_BATCH_SIZE} pépites méconnues et variées.
+            CONTEXTE : Catégorie {mode.upper()} | Style {genre} | Plateforme {platform}.
+            RÈGLES : Œuvres existantes en France, pas de suites ni de spin-offs, auteurs tous différents.
+            """).items("DÉJÀ PROPOSÉS (À NE PAS REPRENDRE) : {items}", known[:30]).text(f"""
+            FORMAT JSON : [{{"titre": "...", "auteur": "{author_label}", "badge": "Badge court", "desc": "1 phrase"}}]
+            """).build()
+            with span("gemini.pool_refill"):
+                response = get_model().generate_content(
+                    pool_prompt,
+                    generation_config=structured_config(reco_list_schema(POOL_BATCH_SIZE)),
+                )
+                get_token_ledger().record("pool", pool_prompt, response)
+            items = parse_recommendations(response.text)
+            get_candidate_index().add(mode, genre, items, platform)
+            images = fetch_images_batch([o["titre"] for o in items], mode)
+            rows = []
+            for o in items:
+                o["img"] = images[o["titre"]]
+                rows.append((scope, normalize_title(o["titre"]), json.dumps(o, ensure_ascii=False), time.time()))
+            with self.lock:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO reco_pool (scope, title_key, item, created_at) VALUES (?, ?, ?, ?)", rows
+                )
+                self.conn.execute(
+                    "DELETE FROM reco_pool WHERE served >= ? OR created_at < ?", (POOL_MAX_SERVES, time.time() - POOL_TTL)
+                )
+                self.conn.execute("DELETE FROM reco_pool_lease WHERE scope = ?", (scope,))
+        except Exception as e:
+            print(f"Erreur recharge réserve ({scope}) : {e}")
+        finally:
+            with self.lock:
+                self.refilling.discard(scope)
+
+@st.cache_resource(show_spinner=False)
+def get_reco_pool():
+    return RecoPool(LOCAL_DB_PATH)
+
+# --- 3quater. MOTEUR DE CANDIDATS (RETRIEVAL TF-IDF + RE-RANKING GEMINI) ---
+
+RETRIEVAL_CANDIDATES = 15       # candidats présentés à Gemini
+RETRIEVAL_MIN_CANDIDATES = 8    # en dessous, on revient à la génération libre
+STOPWORDS = set("""
+    un une des les le la de du et en au aux pour par sur dans avec comme qui que quoi est sont plus tres
+    jeu jeux film films serie series livre livres manga mangas anime animes the and of a to
+""".split())
+
+def franchise_key(title):
+    """Clé de saga : titre avant le sous-titre, sans numéro ni tome/saison"""
+    head = re.split(r"\s*:\s*|\s+[-–—]\s+|\s*\(", str(title or ""), maxsplit=1)[0]
+    key = normalize_title(head)
+    key = re.split(r"\s(?:saison|season|tome|vol|volume|part|partie|chapitre|chapter)\b", key)[0]
+    key = re.sub(r"(?:\s(?:\d+|[ivx]+))+$", "", key)
+    key = re.sub(r"^(?:the|le|la|les|l)\s", "", key)
+    return key or normalize_title(title)
+
+def text_terms(text):
+    return [t for t in normalize_title(text).split() if len(t) > 2 and t not in STOPWORDS]
+
+def names_saga(query_terms, title):
+    """Vrai si la requête nomme la saga de `title` : tous ses mots, ou le dernier, qui la
+    distingue ("un jeu comme Zelda" nomme "The Legend of Zelda: Breath of the Wild")"""
+    saga_terms = text_terms(franchise_key(title))
+    return bool(saga_terms) and (set(saga_terms) <= query_terms or saga_terms[-1] in query_terms)
+
+ALL_PLATFORMS = "Toutes plateformes"
+
+class CandidateIndex:
+    """Catalogue local d'œuvres déjà proposées par Gemini (titre, auteur, description, style),
+    interrogé par TF-IDF : les exclusions (rejets, bibliothèque, saga recherchée) deviennent
+    déterministes et Gemini n'a plus qu'à choisir et justifier parmi une courte liste."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.modes = {}
+        self.conn = open_local_db(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS candidates (
+                mode TEXT NOT NULL,
+                title_key TEXT NOT NULL,
+                title TEXT NOT NULL,
+                author TEXT,
+                descr TEXT,
+                genre TEXT,
+                platform TEXT,
+                added_at REAL NOT NULL,
+                PRIMARY KEY (mode, title_key)
+            )""")
+        # Index créé avant l'ajout de la plateforme : colonne ajoutée, anciennes lignes sans plateforme
+        if "platform" not in {r[1] for r in self.conn.execute("PRAGMA table_info(candidates)")}:
+            self.conn.execute("ALTER TABLE candidates ADD COLUMN platform TEXT")
+
+    def add(self, mode, genre, items, platform=ALL_PLATFORMS):
+        rows = [
+            (mode, normalize_title(i['titre']), i['titre'], i.get('auteur', ''), i.get('desc', ''), genre, platform, time.time())
+            for i in items if i.get('titre')
+        ]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO candidates (mode, title_key, title, author, descr, genre, platform, added_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self.modes.pop(mode, None)  # l'index TF-IDF sera reconstruit à la prochaine recherche
+
+    def _index(self, mode):
+        index = self.modes.get(mode)
+        if index is None or time.time() - index['built_at'] > CATALOG_RELOAD_SECONDS:
+            docs = [
+                {'titre': t, 'auteur': a or '', 'desc': d or '', 'genre': g, 'platform': p, 'key': k}
+                for k, t, a, d, g, p in self.conn.execute(
+                    "SELECT title_key, title, author, descr, genre, platform FROM candidates WHERE mode = ?", (mode,)
+                )
+            ]
+            df = collections.Counter()
+            terms = []
+            for doc in docs:
+                counts = collections.Counter(text_terms(f"{doc['titre']} {doc['auteur']} {doc['desc']} {doc['genre']}"))
+                terms.append(counts)
+                df.update(counts.keys())
+            idf = {t: math.log((1 + len(docs)) / (1 + n)) + 1 for t, n in df.items()}
+            for doc, counts in zip(docs, terms):
+                vec = {t: c * idf[t] for t, c in counts.items()}
+                norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+                doc['vec'] = {t: w / norm for t, w in vec.items()}
+            index = {'docs': docs, 'idf': idf, 'built_at': time.time()}
+            self.modes[mode] = index
+        return index
+
+    @traced("cache.candidates")
+    def retrieve(self, mode, genre, platform, query, excluded, limit=RETRIEVAL_CANDIDATES):
+        """Candidats du style et de la plateforme choisis, classés par pertinence, sans titre exclu
+        (ExclusionSet), sans la saga nommée dans la requête ni celles des derniers rejets, et avec
+        au plus une œuvre par saga"""
+        with self.lock:
+            index = self._index(mode)
+        query_terms = text_terms(query)
+        q_counts = collections.Counter(query_terms + text_terms(genre if genre != 'Général' else ''))
+        q_vec = {t: c * index['idf'][t] for t, c in q_counts.items() if t in index['idf']}
+        if not q_vec:
+            return []
+        query_terms = set(query_terms)
+        blocked_sagas = {franchise_key(query)} | {franchise_key(t) for t in excluded.titles()}
+        scored = []
+        for doc in index['docs']:
+            if genre != "Général" and doc['genre'] != genre:
+                continue
+            # Proposés pour une autre plateforme (ou sans plateforme précise) : disponibilité inconnue
+            if platform != ALL_PLATFORMS and doc['platform'] != platform:
+                continue
+            if names_saga(query_terms, doc['titre']):
+                continue
+            score = sum(w * doc['vec'].get(t, 0.0) for t, w in q_vec.items())
+            if score > 0 and doc['key'] not in excluded:
+                scored.append((score, doc))
+        scored.sort(key=lambda x: -x[0])
+        picked, sagas = [], set(blocked_sagas)
+        for _, doc in scored:
+            saga = franchise_key(doc['titre'])
+            if saga in sagas:
+                continue
+            sagas.add(saga)
+            picked.append(doc)
+            if len(picked) >= limit:
+                break
+        return picked
+
+@st.cache_resource(show_spinner=False)
+def get_candidate_index():
+    return CandidateIndex(LOCAL_DB_PATH)
+
+RERANK_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"id": {"type": "integer"}, "badge": {"type": "string"}, "desc": {"type": "string"}},
+        "required": ["id", "badge", "desc"],
+    },
+    "min_items": 3,
+    "max_items": 3,
+}
+
+def build_rerank_prompt(mode, genre, query, candidates, taste=None):
+    """Prompt court : Gemini choisit 3 candidats par numéro et rédige badge + phrase"""
+    role_def, _ = get_role_def(mode)
+    lines = "\n".join(
+        f"{n}. {c['titre']} — {c['auteur']} : {c['desc'][:90]}" for n, c in enumerate(candidates, 1)
+    )
+    builder = PromptBuilder().text(f"""
+    RÔLE : {role_def}
+    MISSION : L'utilisateur cherche "{query}" (Catégorie {mode} | Style {genre}).
+    """)
+    if taste:
+        taste.add_to(builder)
+    return builder.text(f"""
+    CANDIDATS :
+    {lines}
+    Choisis les 3 candidats les plus pertinents (3 numéros différents, jamais deux œuvres de la même saga).
+    FORMAT JSON : [{{"id": 1, "badge": "Badge court (ex: Pépite, Culte)", "desc": "Pourquoi c'est le choix parfait (1 phrase)."}}]
+    """).build()
+
+def rerank_resolver(candidates):
+    """Associe chaque choix {"id": n} du modèle au candidat n (numéros inconnus ou répétés ignorés)"""
+    used = set()
+
+    def resolve(choice):
+        try:
+            n = int(choice.get("id"))
+        except (TypeError, ValueError):
+            return None
+        if not 1 <= n <= len(candidates) or n in used:
+            return None
+        used.add(n)
+        c = candidates[n - 1]
+        return {
+            'titre': c['titre'],
+            'auteur': c['auteur'],
+            'badge': choice.get('badge') or '⭐ Sélection',
+            'desc': choice.get('desc') or c['desc'],
+        }
+    return resolve
+
+def plan_recommendations(mode, genre, platform, query, exclusions, taste=None):
+    """Choisit la voie la moins coûteuse : réponse en cache, sinon re-classement des candidats
+    locaux, sinon génération libre (ces deux prompts intègrent le profil de goûts `taste`).
+    Renvoie (œuvres en cache ou None, prompt, resolve, generation_config)."""
+    cached = get_reco_cache().lookup(mode, genre, platform, query, exclusions)
+    if cached:
+        return cached, None, None, None
+    candidates = get_candidate_index().retrieve(mode, genre, platform, query, exclusions)
+    if len(candidates) >= RETRIEVAL_MIN_CANDIDATES:
+        prompt = build_rerank_prompt(mode, genre, query, candidates, taste)
+        return None, prompt, rerank_resolver(candidates), structured_config(RERANK_SCHEMA)
+    prompt = build_reco_prompt(mode, genre, query, exclusions, taste)
+    return None, prompt, None, structured_config(reco_list_schema(3))
+
+# --- 3quinquies. RECHERCHE MULTI-CATÉGORIES ("CHERCHER PARTOUT") ---
+
+CATEGORIES = ["🎮 Jeux Vidéo", "🎬 Films", "📺 Séries", "🧧 Animés", "🎋 Mangas", "📚 Livres"]
+EVERYWHERE_GENRE = "Général"
+EVERYWHERE_PLATFORM = ALL_PLATFORMS
+
+class TaggedEvents:
+    """File d'événements partagée : chaque événement du pipeline est préfixé par sa catégorie"""
+
+    def __init__(self, events, mode):
+        self.events = events
+        self.mode = mode
+
+    def put(self, event):
+        self.events.put((self.mode,) + event)
+
+def start_everywhere_pipeline(query, exclusions):
+    """Une même recherche lancée dans toutes les catégories à la fois, sur la boucle partagée.
+    Les visuels passent par le pool commun (titres en double résolus une seule fois).
+    Renvoie ({catégorie: œuvres déjà en cache}, file d'événements (catégorie, type, index, contenu),
+    catégories encore en cours)."""
+    events = queue.Queue()
+    ready, plans = {}, {}
+    for mode in CATEGORIES:
+        cached, prompt, resolve, generation_config = plan_recommendations(
+            mode, EVERYWHERE_GENRE, EVERYWHERE_PLATFORM, query, exclusions, session_taste(mode)
+        )
+        if cached:
+            ready[mode] = cached
+        else:
+            plans[mode] = (prompt, resolve, generation_config)
+    parent = CURRENT_SPAN.get()
+
+    async def run_one(mode, prompt, resolve, generation_config):
+        tagged = TaggedEvents(events, mode)
+        try:
+            with span("pipeline", mode=mode):
+                await stream_recommendations(prompt, mode, tagged, resolve=resolve, generation_config=generation_config, excluded=exclusions)
+        except Exception as e:
+            tagged.put(("error", None, e))
+
+    async def run():
+        CURRENT_SPAN.set(parent)
+        await asyncio.gather(*(run_one(mode, *plan) for mode, plan in plans.items()))
+
+    if plans:
+        asyncio.run_coroutine_threadsafe(run(), get_event_loop())
+    # Visuels des réponses en cache : demandés d'un coup, pendant que les générations tournent
+    futures = [(r, get_image_resolver().submit(r['titre'], mode)) for mode, recos in ready.items() for r in recos]
+    for r, future in futures:
+        r['img'] = future.result()
+    return ready, events, set(plans)
+
+def render_category_row(mode, recos, loading):
+    """Une ligne de résultats par catégorie (squelettes tant que la catégorie n'a pas fini)"""
+    st.markdown(f'<p style="color:white; font-size:22px; font-weight:800; margin:20px 0 5px;">{mode}</p>', unsafe_allow_html=True)
+    if not loading and not recos:
+        st.caption("Aucune pépite trouvée dans cette catégorie.")
+        return
+    cols = st.columns(3)
+    for i in range(3):
+        with cols[i]:
+            if i < len(recos):
+                st.markdown(reco_card_html(recos[i], mode), unsafe_allow_html=True)
+            elif loading:
+                st.markdown(skeleton_card_html(), unsafe_allow_html=True)
+
+# --- CARTES EN FRAGMENTS (UNE ACTION NE RÉEXÉCUTE QUE SA CARTE) ---
+
+def rerun_card():
+    """Réexécute seulement la carte ; rerun complet si la carte est rendue par un passage complet
+    (action traitée pendant un rerun de toute la page)"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+@st.fragment
+def reco_card(i, app_mode, selected_genre, selected_platform):
+    """Carte de recommandation n°i de la session. Un rejet remplace la carte sur place ;
+    « J'y ai joué/vu » vide la sélection, ce qui demande un rerun complet."""
+    item = st.session_state.current_recos[i]
+    auteur_item = item.get('auteur', '')
+    st.markdown(reco_card_html(item, app_mode), unsafe_allow_html=True)
+    
+    with st.expander("📖 Synopsis & Détails"):
+        st.write(f"Découvrez l'univers de **{item['titre']}**. Un choix incontournable pour les amateurs du genre.")
+        synopsis_query = f"{item['titre']} {auteur_item} synopsis français"
+        more_info_url = f"https://www.google.com/search?q={urllib.parse.quote(synopsis_query)}"
+        st.markdown(f"[🔍 En savoir plus]({more_info_url})")
+
+    if st.button(f"❌ Pas pour moi", key=f"rej_{i}", use_container_width=True):
+        save_rejection(st.session_state.user_email, item['titre'], app_mode)
+        mark_seen(item['titre'], app_mode)
+        
+        # Remplacement instantané depuis la réserve, sans doublon avec les cartes affichées
+        on_screen = [r['titre'] for r in st.session_state.current_recos]
+        excluded = get_exclusions().union(on_screen)
+        replacement = get_reco_pool().take(app_mode, selected_genre, selected_platform, excluded, count=1)
+        if replacement:
+            st.session_state.current_recos[i] = replacement[0]
+            rerun_card()
+        
+        with st.spinner("Recherche d'une autre pépite..."):
+            exclude_updated = list(dict.fromkeys(on_screen + get_exclusions().prompt_titles(app_mode)))
+            builder = PromptBuilder().text(f"""
+            RÔLE : Curateur expert en {app_mode} ({selected_genre}).
+            """)
+            taste = session_taste(app_mode)
+            if taste:
+                taste.add_to(builder)
+            replace_prompt = builder.items("MISSION : Propose 1 SEULE nouvelle pépite différente de : {items}.", exclude_updated).text("""
+            RÈGLES : Français uniquement, pas de sequels, pas de doublons.
+            """).build()
+            try:
+                with span("gemini.replace"):
+                    resp = get_model().generate_content(
+                        replace_prompt, generation_config=structured_config(RECO_ITEM_SCHEMA)
+                    )
+                    get_token_ledger().record("replace", replace_prompt, resp)
+                found = parse_recommendations(resp.text, excluded)
+                if not found:
+                    st.toast("⚠️ L'IA a reproposé un titre déjà vu, réessayez !")
+                else:
+                    new_data = found[0]
+                    new_data['img'] = get_image_resolver().submit(new_data['titre'], app_mode).result()
+                    get_candidate_index().add(app_mode, selected_genre, [new_data], selected_platform)
+                    st.session_state.current_recos[i] = new_data
+                    rerun_card()
+            except Exception as e:
+                st.toast("⚠️ Petit hoquet de l'IA, réessayez !")
+
+    if st.button(f"✅ J'y ai joué/vu", key=f"p_{i}", use_container_width=True):
+        if st.session_state.user_email:
+            save_item(st.session_state.user_email, app_mode, item['titre'], item.get('auteur', ''))
+        mark_seen(item['titre'], app_mode)
+        st.session_state.current_recos = None
+        st.rerun()
+
+@st.fragment
+def library_card(idx, title, img, app_mode):
+    """Carte de la bibliothèque, relue dans le profil à chaque passage : cœur, note et suppression
+    ne réexécutent que la carte (les statistiques suivent au prochain rerun complet)"""
+    email = st.session_state.user_email
+    g = get_user_profile(email).find(app_mode, title)
+    if g is None:
+        st.caption(f"🗑️ {title} retiré de votre liste.")
+        return
+    img_lib = thumb(img, "lib")
+    
+    st.markdown(f"""
+        <div style="background:rgba(255,255,255,0.05); padding:15px; border-radius:15px; border:1px solid rgba(255,255,255,0.1); margin-bottom:10px;">
+            <img src="{img_lib}" style="width:100%; height:180px; object-fit:cover; border-radius:10px;">
+            <div style="font-weight:800; margin-top:10px; color:white;">{g['title']}</div>
+            <div style="color:#3B82F6; font-size:0.8rem; font-weight:700;">{g.get('author', 'Auteur inconnu')}</div>
+        </div>
+    """, unsafe_allow_html=True)
+    
+    if st.button("📝 Résumé IA", key=f"sum_{idx}_{g['title']}", use_container_width=True):
+        with st.spinner("Analyse de l'IA..."):
+            summary = get_ai_summary(g['title'], g.get('author', ''), app_mode)
+            st.info(summary)
+    
+    c_btn1, c_btn2, c_btn3 = st.columns([1, 2, 1])
+    with c_btn1:
+        heart = "❤️" if g.get('fav') else "🤍"
+        if st.button(heart, key=f"lib_fav_{idx}_{g['title']}"):
+            toggle_favorite_db(email, app_mode, g['title'], g.get('fav', False))
+            rerun_card()
+    with c_btn2:
+        # Le curseur affiche déjà la nouvelle note : pas besoin de réexécuter la carte
+        new_note = st.select_slider("Note", options=[0,1,2,3,4,5], value=g['rating'], key=f"lib_r_{idx}_{g['title']}", label_visibility="collapsed")
+        if new_note != g['rating']:
+            update_rating_db(email, app_mode, g['title'], new_note)
+    with c_btn3:
+        if st.button("🗑️", key=f"lib_del_{idx}_{g['title']}"):
+            delete_item_db(email, app_mode, g['title'])
+            rerun_card()
+
+# Créée au démarrage (tout est défini à ce stade) : le journal laissé par un processus précédent
+# est rejoué sans attendre la première écriture d'une session
+get_write_queue()
+
 # --- FONCTION PRINCIPALE (MAIN) ---
 def main():
     
     # INITIALISATION DES ÉTATS
     if 'user_email' not in st.session_state: st.session_state.user_email = None
-    if 'seen_items' not in st.session_state: st.session_state.seen_items = []
+    if 'exclusions' not in st.session_state: st.session_state.exclusions = None
     if 'current_recos' not in st.session_state: st.session_state.current_recos = None
+    if 'everywhere_query' not in st.session_state: st.session_state.everywhere_query = ""
+    if 'everywhere_results' not in st.session_state: st.session_state.everywhere_results = None
     if 'last_query' not in st.session_state: st.session_state.last_query = ""
+    if 'profile' not in st.session_state: st.session_state.profile = None
+    if 'pending_writes' not in st.session_state: st.session_state.pending_writes = []
+    if 'lib_page' not in st.session_state: st.session_state.lib_page = 0
+    
+    # Confirmation asynchrone des écritures différées
+    confirm_writes()
 
     # --- 4. DESIGN (STYLE PREMIUM & HAUTE VISIBILITÉ) ---
     st.markdown("""
@@ -295,7 +3168,7 @@ def main():
     with st.sidebar:
         st.markdown('<h1 style="color:#3B82F6; font-size:34px; font-weight:900; margin-bottom:20px;">MENU</h1>', unsafe_allow_html=True)
         
-        app_mode = st.radio("Catégorie", ["🎮 Jeux Vidéo", "🎬 Films", "📺 Séries", "🧧 Animés", "🎋 Mangas", "📚 Livres"], key="final_category_radio")
+        app_mode = st.radio("Catégorie", CATEGORIES, key="final_category_radio")
         
         st.write("---")
         st.markdown('<p style="color:white; font-size:22px; font-weight:800; margin-bottom:10px;">🎁 Offres du moment</p>', unsafe_allow_html=True)
@@ -318,8 +3191,63 @@ def main():
                 st.rerun()
         else:
             st.write(f"Connecté : **{st.session_state.user_email}**")
-            if st.button("Déconnexion", key="sidebar_logout_btn"): st.session_state.user_email = None; st.rerun()
-    
+            if st.button("Déconnexion", key="sidebar_logout_btn"): st.session_state.user_email = None; st.session_state.profile = None; st.session_state.exclusions = None; st.rerun()
+
+        # --- DIAGNOSTIC (ADMINS UNIQUEMENT) ---
+        if is_admin(st.session_state.user_email):
+            with st.expander("🛠️ Diagnostics"):
+                art = get_artwork_cache().stats()
+                st.caption(f"Cache visuels : {art['hits']} hits · {art['negative_hits']} hits négatifs · {art['misses']} miss · {art['hit_rate']:.0%} · {art['entries']} entrées")
+                tk = get_token_ledger().stats()
+                if tk['kinds']:
+                    st.caption("Jetons Gemini (prompt / réponse) : " + " · ".join(
+                        f"{kind} {v['prompt'] // max(1, v['calls'])} / {v['response'] // max(1, v['calls'])} en moyenne sur {v['calls']} appels" for kind, v in tk['kinds'].items()
+                    ) + f" · estimation {tk['chars_per_token']:.2f} car./jeton")
+                th = get_thumbnails().stats()
+                st.caption(f"Vignettes : {th['hits']} servies · {th['misses']} absentes · {th['built']} visuels traités · {th['files']} fichiers ({th['bytes'] / 1e6:.1f} Mo) · {th['saved']:.0%} d'octets économisés")
+                cat = get_catalog().stats()
+                st.caption(f"Catalogue local : {cat['exact_hits']} exacts · {cat['fuzzy_hits']} approchés · {cat['misses']} miss · {cat['hit_rate']:.0%}")
+                rc = get_reco_cache().stats()
+                wq = get_write_queue().stats()
+                st.caption(f"Écritures différées : {wq['pending']} en attente · {wq['applied']} appliquées · {wq['coalesced']} fusionnées · {wq['failed']} échecs")
+                sm, lw = get_summary_store().stats(), get_library_warmer().stats()
+                st.caption(f"Résumés IA : {sm['hits']} hits · {sm['misses']} miss · {sm['hit_rate']:.0%} · {sm['entries']} en stock · préchauffage : {lw['accounts']} comptes, {lw['images']} visuels ({lw['skipped']} reportés), {lw['summaries']} résumés")
+                sf = get_single_flight().stats()
+                if sf:
+                    st.caption("Single-flight : " + " · ".join(f"{kind} {v['calls']} appels, {v['suppressed']} doublons évités" for kind, v in sf.items()))
+                st.caption(f"Cache Gemini : {rc['hits']} hits (dont {rc['semantic_hits']} sémantiques) · {rc['misses']} miss · {rc['hit_rate']:.0%} · {rc['saved_seconds']:.0f} s économisées")
+                clock = get_startup_clock()
+                if clock.cold_paint is not None:
+                    since_process = f" ({clock.cold_process * 1000:.0f} ms depuis le lancement du processus)" if clock.cold_process else ""
+                    st.caption(f"Démarrage à froid : premier affichage en {clock.cold_paint * 1000:.0f} ms{since_process} · cette session : {st.session_state.get('first_paint_ms') or 0:.0f} ms")
+                for name, client in get_provider_clients().items():
+                    ps = client.stats()
+                    st.caption(f"{name} : {ps['calls']} appels · {ps['errors']} erreurs · {ps['retries']} retries · {ps['throttled']} bridés · moy {ps['avg_ms']:.0f} ms · p95 {ps['p95_ms']:.0f} ms")
+                for chain_mode, ranked in get_provider_ranking().stats().items():
+                    st.caption(f"Visuels {chain_mode} : " + " → ".join(f"{p} {'–' if rate is None else f'{rate:.0%}'} · {ms:.0f} ms" for p, rate, ms in ranked))
+
+            # Trace des exécutions précédentes (celle en cours n'est pas terminée)
+            traces = list(st.session_state.get('traces', []))
+            if traces:
+                with st.expander("⏱️ Trace des requêtes"):
+                    # 0 = la plus récente (le choix reste stable quand de nouvelles traces arrivent)
+                    picked = st.selectbox(
+                        "Exécution", range(len(traces)), key="trace_pick",
+                        format_func=lambda i: f"-{i + 1} · {1000 * (traces[-1 - i].duration or 0):.0f} ms",
+                    )
+                    root = traces[-1 - picked]
+                    parts = root.breakdown()
+                    if parts:
+                        st.caption(" · ".join(f"{family} {1000 * t:.0f} ms" for family, t in parts.most_common()))
+                    lines = []
+                    for depth, node in root.walk():
+                        took = "en cours" if node.duration is None else f"{1000 * node.duration:.0f} ms"
+                        extra = "".join(f" {k}={v}" for k, v in node.attrs.items())
+                        flag = f" ⚠️ {node.error}" if node.error else ""
+                        lines.append(f"{'  ' * depth}{node.name} {took}{extra}{flag}")
+                    st.code("\n".join(lines), language=None)
+                    st.caption(f"Métriques Prometheus : {get_metrics().path}")
+
         st.write("---")
         st.markdown('<p style="color:white; font-size:22px; font-weight:800;">💙 Soutenir</p>', unsafe_allow_html=True)
         st.markdown(f'<a href="https://www.paypal.me/TheShortlistApp" target="_blank" class="paypal-button" style="background:#0070BA; color:white; padding:12px; border-radius:10px; display:block; text-align:center; text-decoration:none; font-weight:bold;">☕ Offrir un café (PayPal)</a>', unsafe_allow_html=True)
@@ -369,15 +3297,30 @@ def main():
             key="main_search_input"
         )
         
+        everywhere = st.toggle("🌐 Chercher dans toutes les catégories", key="search_everywhere")
         b1, b2 = st.columns(2)
         with b1:
             if st.button("🔎 TROUVER", use_container_width=True, key="search_btn"):
-                st.session_state.last_query = query
+                if everywhere:
+                    st.session_state.everywhere_query = query
+                    st.session_state.everywhere_results = None
+                    st.session_state.last_query = ""
+                else:
+                    st.session_state.last_query = query
+                    st.session_state.everywhere_query = ""
                 st.session_state.current_recos = None
         with b2:
             if st.button("🎲 SURPRENDS-MOI", use_container_width=True, key="surprise_btn"):
+                st.session_state.everywhere_query = ""
                 st.session_state.last_query = f"Une pépite de type {media_label.lower()} méconnue"
-                st.session_state.current_recos = None
+                # Réponse instantanée depuis la réserve pré-générée (Gemini seulement si elle est à sec)
+                st.session_state.current_recos = get_reco_pool().take(app_mode, selected_genre, selected_platform, get_exclusions(), count=3)
+        
+        # Page utilisable : tout ce qui suit peut contacter Gemini ou les fournisseurs
+        mark_first_paint()
+    
+        # La réserve de la sélection courante se recharge en arrière-plan si elle s'épuise
+        get_reco_pool().ensure(app_mode, selected_genre, selected_platform)
     
         # --- NOTE EXPLICATIVE ---
         with st.expander("ℹ️ Comment utiliser The Shortlist ?"):
@@ -399,164 +3342,189 @@ def main():
     
         # --- LOGIQUE IA AVEC CHARGEMENT ANIMÉ (CORRIGÉ) ---
         if st.session_state.last_query and st.session_state.current_recos is None:
-            # 1. Préparation des données (Favoris, Exclusions...)
-            import datetime
-            limit_date = (datetime.datetime.now() - datetime.timedelta(days=14)).isoformat()
-            lib = load_data(st.session_state.user_email, app_mode) if st.session_state.user_email else []
-            favs = [g['title'] for g in lib if g['rating'] >= 4]
-            
-            historical_dislikes = []
-            if st.session_state.user_email:
-                try:
-                    res_dis = supabase.table("user_dislikes").select("item_title")\
-                        .eq("user_email", st.session_state.user_email)\
-                        .gt("created_at", limit_date).execute()
-                    historical_dislikes = [d['item_title'] for d in res_dis.data]
-                except: pass
-            
-            exclude_list = list(set(st.session_state.seen_items + historical_dislikes))
-            exclude = ", ".join(exclude_list)
+            # 1. Préparation des données : goûts (titres bien notés, coups de cœur), exclusions
+            taste = session_taste(app_mode) if st.session_state.user_email else None
+            # Vus, rejetés et bibliothèque : filtrés après coup, seuls les plus récents sont cités au modèle
+            exclusions = get_exclusions()
             
-            # --- DÉBUT DU BLOC PROMPT FINAL ---
-            
-            # 1. Nettoyage du type de média
-            media_clean = app_mode.split(" ")[1]
-            if "Jeux" in app_mode: media_clean = "Jeux Vidéo"
-            
-            # 2. Définition des rôles
-            if "Séries" in app_mode:
-                role_def = "Expert en SÉRIES TV."
-                author_label = "le créateur (Showrunner)"
-            elif "Films" in app_mode:
-                role_def = "Expert en CINÉMA."
-                author_label = "le réalisateur"
-            elif "Jeux" in app_mode:
-                role_def = "Expert en GAMING."
-                author_label = "le studio"
-            else:
-                role_def = f"Expert en {media_clean}."
-                author_label = "l'auteur"
-    
-            # 3. Le Prompt
-            prompt = f"""
-            RÔLE : {role_def}
-            MISSION : L'utilisateur cherche "{st.session_state.last_query}".
-            CONTEXTE : Catégorie {app_mode.upper()} | Style {selected_genre}.
-            
-            🧠 PROTOCOLE D'ANALYSE (IMPORTANT) :
-            1. Est-ce que tu connais PRÉCISÉMENT l'œuvre "{st.session_state.last_query}" ?
-                - OUI -> Propose 3 œuvres SIMILAIRES (même vibe/public) mais d'auteurs différents.
-                - NON (Titre inconnu) -> IGNORE le titre. Propose 3 pépites incontournables du genre "{selected_genre}" qui correspondent à l'ambiance des mots-clés.
-            
-            ⛔ RÈGLES D'EXCLUSION (CRITIQUE) :
-            1. ANTI-PERROQUET : Ne propose JAMAIS le titre recherché "{st.session_state.last_query}" en résultat.
-            2. ANTI-FRANCHISE : Pas de suites, pas de spin-offs (Ex: Si recherche "Walking Dead", INTERDIT "Fear the Walking Dead").
-            3. CATÉGORIE STRICTE : Si je suis dans {app_mode}, ne propose RIEN d'autre (Pas de livre si je suis dans Jeux !).
-            
-            INSTRUCTIONS :
-            1. CIBLE : Si le genre est "Dark Romance", propose UNIQUEMENT de la Dark Romance (pas de policier classique !).
-            2. RÉALISME : Uniquement des œuvres existantes en France.
-            3. STRUCTURE JSON : Le champ "auteur" doit contenir {author_label}.
+            # --- CACHE DE RÉPONSES, SINON RE-CLASSEMENT DE CANDIDATS LOCAUX, SINON GÉNÉRATION LIBRE ---
+            reco_cache = get_reco_cache()
+            cached_recos, prompt, resolve, generation_config = plan_recommendations(
+                app_mode, selected_genre, selected_platform, st.session_state.last_query, exclusions, taste
+            )
+            if cached_recos:
+                image_results = fetch_images_batch([r['titre'] for r in cached_recos], app_mode)
+                for r in cached_recos:
+                    r['img'] = image_results[r['titre']]
+                st.session_state.current_recos = cached_recos
+                st.rerun()
             
-            FORMAT DE RÉPONSE (JSON PUR) :
-            [
-                {{
-                "titre": "Titre exact officiel",
-                "auteur": "Nom ({author_label})",
-                "badge": "Badge court (ex: Pépite, Culte)",
-                "desc": "Pourquoi c'est le choix parfait (1 phrase)."
-                }}
-            ]
-            """
             # --- DÉBUT DE L'ANIMATION COMPLEXE (CORRIGÉ) ---
             loader_placeholder = st.empty()
             # On récupère les faits correspondant à la catégorie actuelle
             current_facts = LOADING_FACTS.get(app_mode, LOADING_FACTS["Autre"])
             
-            # 1. LANCEMENT DE L'IA EN ARRIÈRE-PLAN
-            executor = ThreadPoolExecutor()
-            future = executor.submit(model.generate_content, prompt)
+            # 1. LANCEMENT DU PIPELINE EN ARRIÈRE-PLAN (Gemini en streaming + visuels au fil de l'eau)
+            pipeline_started = time.monotonic()
+            events = start_recommendation_pipeline(prompt, app_mode, resolve=resolve, generation_config=generation_config, excluded=exclusions)
     
-            # 2. BOUCLE D'ANIMATION (Tant que l'IA n'a pas fini)
+            # 2. BOUCLE D'ANIMATION PILOTÉE PAR LES ÉVÉNEMENTS (plus d'attente fixe après la réponse)
             fact_index = 0
+            next_fact_at = 0
             loading_gif = "https://media2.giphy.com/media/v1.Y2lkPTc5MGI3NjExMTZncXE1NHFyZWJiNGI2M3ZzbDZhNXlnbXR4b3hvYzk3eWt3Zjk1bSZlcD12MV9pbnRlcm5hbF9naWZfYnlfaWQmY3Q9Zw/XRj99a68ZhhIrHReGc/giphy.gif"
+            recos = []
+            pipeline_error = None
+            finished = False
+            last_event_at = time.monotonic()
+            # Les cartes s'affichent une à une, dès que leur objet JSON est complet
+            stream_placeholder = st.empty()
             
-            while not future.done():
-                # A. DÉCIDER SI C'EST UNE PROMO OU UNE ANECDOTE
-                if fact_index % 4 == 0 and fact_index > 0:
-                    fact = PROMO_FACTS[fact_index % len(PROMO_FACTS)]
-                    prefix = "💸 BON PLAN PARTENAIRE"
-                    color = "#10B981" 
-                else:
-                    if len(current_facts) > 0:
-                        fact = current_facts[fact_index % len(current_facts)]
+            while not finished:
+                if not recos and time.monotonic() >= next_fact_at:
+                    # A. DÉCIDER SI C'EST UNE PROMO OU UNE ANECDOTE
+                    if fact_index % 4 == 0 and fact_index > 0:
+                        fact = PROMO_FACTS[fact_index % len(PROMO_FACTS)]
+                        prefix = "💸 BON PLAN PARTENAIRE"
+                        color = "#10B981" 
                     else:
-                        fact = "Recherche en cours..."
-                    prefix = "⚡ ANALYSE EN COURS..."
-                    color = "#3B82F6"
+                        if len(current_facts) > 0:
+                            fact = current_facts[fact_index % len(current_facts)]
+                        else:
+                            fact = "Recherche en cours..."
+                        prefix = "⚡ ANALYSE EN COURS..."
+                        color = "#3B82F6"
     
-                # B. CRÉER LE HTML DYNAMIQUE
-                html_content = f"""
-                <div style="background-color: #111827; border: 2px solid {color}; border-radius: 15px; padding: 30px; text-align: center; margin-top: 20px; box-shadow: 0 0 30px rgba(59, 130, 246, 0.2);">
-                    <h3 style="color: {color}; font-weight: 900; margin-bottom: 25px; letter-spacing: 1px;">{prefix}</h3>
-                    <img src="{loading_gif}" style="width: 250px; border-radius: 8px; margin-bottom: 25px; opacity: 0.9;">
-                    <div style="min-height: 90px; display: flex; align-items: center; justify-content: center; background: rgba(255,255,255,0.05); border-radius: 10px; padding: 15px;">
-                        <p style="color: white; font-size: 17px; font-style: italic; font-weight: 500; line-height: 1.4;">
-                            " {fact} "
-                        </p>
-                    </div>
-                    <div style="margin-top: 15px;">
-                            <div style="width: 100%; height: 4px; background: #374151; border-radius: 2px; overflow: hidden;">
-                            <div style="width: 50%; height: 100%; background: {color}; animation: loading-bar 2s infinite ease-in-out;"></div>
+                    # B. CRÉER LE HTML DYNAMIQUE
+                    html_content = f"""
+                    <div style="background-color: #111827; border: 2px solid {color}; border-radius: 15px; padding: 30px; text-align: center; margin-top: 20px; box-shadow: 0 0 30px rgba(59, 130, 246, 0.2);">
+                        <h3 style="color: {color}; font-weight: 900; margin-bottom: 25px; letter-spacing: 1px;">{prefix}</h3>
+                        <img src="{loading_gif}" style="width: 250px; border-radius: 8px; margin-bottom: 25px; opacity: 0.9;">
+                        <div style="min-height: 90px; display: flex; align-items: center; justify-content: center; background: rgba(255,255,255,0.05); border-radius: 10px; padding: 15px;">
+                            <p style="color: white; font-size: 17px; font-style: italic; font-weight: 500; line-height: 1.4;">
+                                " {fact} "
+                            </p>
+                        </div>
+                        <div style="margin-top: 15px;">
+                                <div style="width: 100%; height: 4px; background: #374151; border-radius: 2px; overflow: hidden;">
+                                <div style="width: 50%; height: 100%; background: {color}; animation: loading-bar 2s infinite ease-in-out;"></div>
+                            </div>
+                            <p style="color: #6B7280; font-size: 11px; margin-top: 8px; text-transform: uppercase; font-weight: bold;">Recherche dans la base de données...</p>
                         </div>
-                        <p style="color: #6B7280; font-size: 11px; margin-top: 8px; text-transform: uppercase; font-weight: bold;">Recherche dans la base de données...</p>
                     </div>
-                </div>
-                <style>
-                @keyframes loading-bar {{ 
-                    0% {{ transform: translateX(-100%); }} 
-                    50% {{ transform: translateX(100%); }} 
-                    100% {{ transform: translateX(-100%); }} 
-                }}
-                </style>
-                """
-                with loader_placeholder.container():
-                    st.markdown(html_content, unsafe_allow_html=True)
+                    <style>
+                    @keyframes loading-bar {{ 
+                        0% {{ transform: translateX(-100%); }} 
+                        50% {{ transform: translateX(100%); }} 
+                        100% {{ transform: translateX(-100%); }} 
+                    }}
+                    </style>
+                    """
+                    with loader_placeholder.container():
+                        st.markdown(html_content, unsafe_allow_html=True)
+                    fact_index += 1
+                    next_fact_at = time.monotonic() + 3.5
                 
-                time.sleep(3.5)
-                fact_index += 1
+                # On se réveille dès qu'un événement arrive, à l'échéance de l'anecdote tant qu'aucune
+                # carte n'est affichée, et au moins toutes les STREAM_POLL_INTERVAL secondes : chaque
+                # rafraîchissement laisse Streamlit interrompre la boucle sur un stop ou un rerun
+                wait = STREAM_POLL_INTERVAL if recos else min(STREAM_POLL_INTERVAL, max(0.0, next_fact_at - time.monotonic()))
+                try:
+                    kind, index, payload = events.get(timeout=wait)
+                except queue.Empty:
+                    if time.monotonic() - last_event_at > STREAM_STALL_TIMEOUT:
+                        # Flux bloqué : on garde les cartes reçues, la réparation comblera le reste
+                        pipeline_error = TimeoutError("la génération ne répond plus")
+                        break
+                    if recos:
+                        loader_placeholder.markdown(f"<p style='text-align:center; color:#3B82F6; font-weight:700;'>⚡ {len(recos)}/3 pépites trouvées...</p>", unsafe_allow_html=True)
+                    continue
+                last_event_at = time.monotonic()
+                if kind == "item":
+                    recos.append(payload)
+                elif kind == "img":
+                    recos[index]['img'] = payload
+                elif kind == "error":
+                    pipeline_error = payload
+                    finished = True
+                else:
+                    finished = True
+                
+                if recos and not finished:
+                    loader_placeholder.markdown(f"<p style='text-align:center; color:#3B82F6; font-weight:700;'>⚡ {len(recos)}/3 pépites trouvées...</p>", unsafe_allow_html=True)
+                    with stream_placeholder.container():
+                        stream_cols = st.columns(3)
+                        for i in range(3):
+                            with stream_cols[i]:
+                                card = reco_card_html(recos[i], app_mode) if i < len(recos) else skeleton_card_html()
+                                st.markdown(card, unsafe_allow_html=True)
             
             # --- L'IA A FINI ! ---
             try:
-                response = future.result() # On récupère le résultat
-                executor.shutdown(wait=False)
-                
-                # Nettoyage et Parsing JSON
-                json_match = re.search(r'\[.*\]', response.text, re.DOTALL)
-                if json_match:
-                    recos = json.loads(json_match.group())
-                    
-                    loader_placeholder.markdown("<p style='text-align:center; color:#3B82F6;'>✅ Analyse terminée. Récupération des visuels...</p>", unsafe_allow_html=True)
-                    
-                    with ThreadPoolExecutor(max_workers=3) as img_executor:
-                        titles = [r['titre'] for r in recos]
-                        image_results = list(img_executor.map(lambda t: fetch_image_turbo(t, app_mode), titles))
-                    
-                    for i, r in enumerate(recos):
-                        r['img'] = image_results[i]
-                    
+                if pipeline_error and not recos:
+                    raise pipeline_error
+                # Flux interrompu : les visuels des cartes déjà reçues n'arriveront plus par le pipeline
+                unresolved = [r['titre'] for r in recos if not r.get('img')]
+                if unresolved:
+                    images = fetch_images_batch(unresolved, app_mode)
+                    for r in recos:
+                        if not r.get('img'):
+                            r['img'] = images[r['titre']]
+                # Réponse incomplète : on ne comble que les places manquantes, sans relancer toute la génération
+                if len(recos) < 3:
+                    recos = repair_recommendations(
+                        recos, app_mode, selected_genre, selected_platform, st.session_state.last_query, exclusions
+                    )
+                if recos:
+                    reco_cache.store(app_mode, selected_genre, selected_platform, st.session_state.last_query, recos, time.monotonic() - pipeline_started)
+                    get_candidate_index().add(app_mode, selected_genre, recos, selected_platform)
                     st.session_state.current_recos = recos
                     loader_placeholder.empty()
                     st.rerun()
                 else:
                     loader_placeholder.error("L'IA a renvoyé un format illisible. Réessaie !")
-                    time.sleep(2)
-                    st.session_state.current_recos = None
-                    st.rerun()
     
             except Exception as e:
                 loader_placeholder.error(f"Erreur technique : {e}")
 
+        # --- RECHERCHE MULTI-CATÉGORIES : 6 générations en parallèle, affichées au fil de l'eau ---
+        if st.session_state.everywhere_query and st.session_state.everywhere_results is None:
+            everywhere_query = st.session_state.everywhere_query
+            started = time.monotonic()
+            results, events, pending = start_everywhere_pipeline(everywhere_query, get_exclusions())
+            for mode in pending:
+                results[mode] = []
+            status = st.empty()
+            slots = {mode: st.empty() for mode in CATEGORIES}
+            for mode in CATEGORIES:
+                with slots[mode].container():
+                    render_category_row(mode, results[mode], loading=mode in pending)
+            while pending:
+                status.markdown(f"<p style='text-align:center; color:#3B82F6; font-weight:700;'>⚡ {len(CATEGORIES) - len(pending)}/{len(CATEGORIES)} catégories prêtes...</p>", unsafe_allow_html=True)
+                try:
+                    mode, kind, index, payload = events.get(timeout=60)
+                except queue.Empty:
+                    break
+                if kind == "item":
+                    results[mode].append(payload)
+                elif kind == "img":
+                    results[mode][index]['img'] = payload
+                else:
+                    pending.discard(mode)
+                    if kind == "error":
+                        print(f"Erreur recherche multi-catégories ({mode}) : {payload}")
+                    elif results[mode]:
+                        get_reco_cache().store(mode, EVERYWHERE_GENRE, EVERYWHERE_PLATFORM, everywhere_query, results[mode], time.monotonic() - started)
+                        get_candidate_index().add(mode, EVERYWHERE_GENRE, results[mode])
+                with slots[mode].container():
+                    render_category_row(mode, results[mode], loading=mode in pending)
+            st.session_state.everywhere_results = results
+            st.rerun()
+
+        if st.session_state.everywhere_query and st.session_state.everywhere_results:
+            st.write("---")
+            for mode in CATEGORIES:
+                render_category_row(mode, st.session_state.everywhere_results.get(mode, []), loading=False)
+
         # --- 6. AFFICHAGE DES RÉSULTATS ---
         if st.session_state.current_recos:
             st.write("---")
@@ -580,80 +3548,16 @@ def main():
             </div>
             """, unsafe_allow_html=True)
             
-            for i, item in enumerate(st.session_state.current_recos):
+            for i in range(len(st.session_state.current_recos)):
                 with cols[i]:
-                    auteur_item = item.get('auteur', '')
-                    affiliate_link = get_smart_link(item['titre'], auteur_item, app_mode)
-                    img_url = item['img'] if item['img'] else "https://placehold.co/400x600"
-    
-                    if app_mode == "🎮 Jeux Vidéo":
-                        btn_text = "🎮 VOIR PRIX (INSTANT GAMING)"
-                        btn_color = "#FF5400"
-                    elif app_mode in ["🎬 Films", "📺 Séries"]:
-                        btn_text = "🍿 VOIR SUR PRIME VIDEO"
-                        btn_color = "#00A8E1"
-                    else:
-                        btn_text = "🛒 VOIR SUR AMAZON"
-                        btn_color = "#FF9900"
-                    
-                    badge_text = item.get('badge', '⭐ Sélection')
-                    st.markdown(f"""
-                        <div class="game-card" style="position: relative; background: rgba(255,255,255,0.05); padding: 20px; border-radius: 15px; border: 1px solid rgba(255,255,255,0.1);">
-                            <div style="position: absolute; top: 10px; right: 10px; background: #3B82F6; color: white; padding: 4px 12px; border-radius: 20px; font-size: 0.7rem; font-weight: 900; z-index: 10;">
-                                {badge_text}
-                            </div>
-                            <img src="{img_url}" style="width:100%; height:250px; object-fit:cover; border-radius:15px;">
-                            <div style="font-weight:800; margin-top:15px; font-size:1.1rem; color:white;">{item['titre']}</div>
-                            <div style="color:#3B82F6; font-size:0.8rem; font-weight:700;">{item.get('auteur', '')}</div>
-                            <div style="color:rgba(255,255,255,0.6); font-size:0.85rem; margin-top:10px; height: 60px; overflow: hidden;">{item['desc']}</div>
-                            <a href="{affiliate_link}" target="_blank" style="display: block; text-align: center; background: {btn_color}; color: white; text-decoration: none; padding: 12px; border-radius: 12px; margin-top: 15px; font-weight: 800; font-size: 0.9rem; box-shadow: 0 4px 6px rgba(0,0,0,0.2);">
-                                {btn_text}
-                            </a>
-                        </div>
-                    """, unsafe_allow_html=True)
-                    
-                    with st.expander("📖 Synopsis & Détails"):
-                        st.write(f"Découvrez l'univers de **{item['titre']}**. Un choix incontournable pour les amateurs du genre.")
-                        synopsis_query = f"{item['titre']} {auteur_item} synopsis français"
-                        more_info_url = f"https://www.google.com/search?q={urllib.parse.quote(synopsis_query)}"
-                        st.markdown(f"[🔍 En savoir plus]({more_info_url})")
-    
-                    if st.button(f"❌ Pas pour moi", key=f"rej_{i}", use_container_width=True):
-                        save_rejection(st.session_state.user_email, item['titre'], app_mode)
-                        st.session_state.seen_items.append(item['titre'])
-                        
-                        with st.spinner("Recherche d'une autre pépite..."):
-                            exclude_updated = ", ".join(st.session_state.seen_items)
-                            replace_prompt = f"""
-                            RÔLE : Curateur expert en {app_mode} ({selected_genre}).
-                            MISSION : Propose 1 SEULE nouvelle pépite différente de : {exclude_updated}.
-                            RÈGLES : Français uniquement, pas de sequels, pas de doublons.
-                            FORMAT JSON : {{"titre": "...", "auteur": "...", "desc": "..."}}
-                            """
-                            try:
-                                resp = model.generate_content(replace_prompt)
-                                match = re.search(r'\{.*\}', resp.text, re.DOTALL)
-                                if match:
-                                    new_data = json.loads(match.group())
-                                    new_data['img'] = fetch_image_turbo(new_data['titre'], app_mode)
-                                    st.session_state.current_recos[i] = new_data
-                                    st.rerun()
-                            except Exception as e:
-                                st.toast("⚠️ Petit hoquet de l'IA, réessayez !")
-    
-                    if st.button(f"✅ J'y ai joué/vu", key=f"p_{i}", use_container_width=True):
-                        if st.session_state.user_email:
-                            save_item(st.session_state.user_email, app_mode, item['titre'], item.get('auteur', ''))
-                        st.session_state.seen_items.append(item['titre'])
-                        st.session_state.current_recos = None
-                        st.rerun()
+                    reco_card(i, app_mode, selected_genre, selected_platform)
     
             st.write("---")
             _, c_reload, _ = st.columns([1, 2, 1])
             with c_reload:
                 if st.button("🔄 Proposer 3 autres options", use_container_width=True):
                     for item in st.session_state.current_recos:
-                        st.session_state.seen_items.append(item['titre'])
+                        mark_seen(item['titre'], app_mode)
                     st.session_state.current_recos = None
                     st.rerun()
     
@@ -662,27 +3566,24 @@ def main():
             if not st.session_state.user_email:
                 st.info("Connectez-vous pour voir votre collection personnelle.")
             else:
-                full_data = load_data(st.session_state.user_email, app_mode)
+                lib_stats = load_library_stats(st.session_state.user_email, app_mode)
                 
                 st.markdown('<p style="font-size:26px; font-weight:900; color:#3B82F6;">📊 MES STATS</p>', unsafe_allow_html=True)
-                total_items = len(full_data)
-                fav_count = len([g for g in full_data if g.get('fav')])
-                avg_rating = sum([g['rating'] for g in full_data]) / total_items if total_items > 0 else 0
-                
                 c_stat1, c_stat2, c_stat3 = st.columns(3)
-                with c_stat1: st.metric("Titres dans ma liste", total_items)
-                with c_stat2: st.metric("Coups de cœur ❤️", fav_count)
-                with c_stat3: st.metric("Note moyenne ⭐", f"{avg_rating:.1f}/5")
+                with c_stat1: st.metric("Titres dans ma liste", lib_stats.total)
+                with c_stat2: st.metric("Coups de cœur ❤️", lib_stats.favs)
+                with c_stat3: st.metric("Note moyenne ⭐", f"{lib_stats.avg_rating:.1f}/5")
                 
                 st.write("---")
                 st.markdown('<p style="font-size:26px; font-weight:900; color:#FF3366; margin-bottom:20px;">❤️ MES COUPS DE CŒUR</p>', unsafe_allow_html=True)
-                absolute_favs = [g for g in full_data if g.get('fav')]
+                absolute_favs = lib_stats.top_favs
                 
                 if absolute_favs:
+                    fav_imgs = fetch_images_batch([g['title'] for g in absolute_favs], app_mode)
                     fav_cols = st.columns(5)
-                    for idx, g in enumerate(absolute_favs[:5]):
+                    for idx, g in enumerate(absolute_favs):
                         with fav_cols[idx]:
-                            img_fav = fetch_image_turbo(g['title'], app_mode)
+                            img_fav = thumb(fav_imgs[g['title']], "fav")
                             st.markdown(f"""
                                 <div style="text-align:center; margin-bottom:20px;">
                                     <img src="{img_fav}" style="width:100%; height:140px; object-fit:cover; border-radius:10px; border:2px solid #FF3366;">
@@ -695,51 +3596,56 @@ def main():
                 st.write("---")
                 st.markdown('<p style="font-size:26px; font-weight:900; color:#3B82F6; margin-bottom:20px;">📚 MA COLLECTION</p>', unsafe_allow_html=True)
                 
-                search_lib = st.text_input("🔍 Rechercher un titre sauvegardé...", key="lib_search_input")
-                filtered_data = [d for d in full_data if search_lib.lower() in d['title'].lower()]
+                c_search, c_sort, c_size = st.columns([3, 1, 1])
+                with c_search:
+                    search_lib = st.text_input("🔍 Rechercher un titre sauvegardé...", key="lib_search_input")
+                with c_sort:
+                    sort_lib = st.selectbox("Tri", list(LIBRARY_SORTS), key="lib_sort")
+                with c_size:
+                    page_size = st.selectbox("Par page", LIBRARY_PAGE_SIZES, key="lib_page_size")
+                
+                # Nouvelle recherche / tri / taille : retour à la première page
+                page_query = (app_mode, search_lib, sort_lib, page_size)
+                if st.session_state.get('lib_page_query') != page_query:
+                    st.session_state.lib_page_query = page_query
+                    st.session_state.lib_page = 0
+                
+                filtered_data, total_matches = load_library_page(
+                    st.session_state.user_email, app_mode, search_lib, sort_lib, st.session_state.lib_page, page_size
+                )
+                page_count = max(1, -(-total_matches // page_size))
+                if st.session_state.lib_page >= page_count:
+                    st.session_state.lib_page = page_count - 1
+                    st.rerun()
                 
                 if not filtered_data:
                     st.info("Votre bibliothèque est vide ou aucun titre ne correspond à votre recherche.")
                 else:
+                    # Seule la page affichée est rendue : coût constant quelle que soit la taille de la collection
+                    lib_imgs = fetch_images_batch([g['title'] for g in filtered_data], app_mode)
                     lib_cols = st.columns(3)
                     for idx, g in enumerate(filtered_data):
-                        col_idx = idx % 3
-                        with lib_cols[col_idx]:
-                            img_lib = fetch_image_turbo(g['title'], app_mode)
-                            
-                            st.markdown(f"""
-                                <div style="background:rgba(255,255,255,0.05); padding:15px; border-radius:15px; border:1px solid rgba(255,255,255,0.1); margin-bottom:10px;">
-                                    <img src="{img_lib}" style="width:100%; height:180px; object-fit:cover; border-radius:10px;">
-                                    <div style="font-weight:800; margin-top:10px; color:white;">{g['title']}</div>
-                                    <div style="color:#3B82F6; font-size:0.8rem; font-weight:700;">{g.get('author', 'Auteur inconnu')}</div>
-                                </div>
-                            """, unsafe_allow_html=True)
-                            
-                            if st.button("📝 Résumé IA", key=f"sum_{idx}_{g['title']}", use_container_width=True):
-                                with st.spinner("Analyse de l'IA..."):
-                                    summary = get_ai_summary(g['title'], g.get('author', ''), app_mode)
-                                    st.info(summary)
-                            
-                            c_btn1, c_btn2, c_btn3 = st.columns([1, 2, 1])
-                            with c_btn1:
-                                heart = "❤️" if g.get('fav') else "🤍"
-                                if st.button(heart, key=f"lib_fav_{idx}_{g['title']}"):
-                                    toggle_favorite_db(st.session_state.user_email, app_mode, g['title'], g.get('fav', False))
-                                    st.rerun()
-                            with c_btn2:
-                                new_note = st.select_slider("Note", options=[0,1,2,3,4,5], value=g['rating'], key=f"lib_r_{idx}_{g['title']}", label_visibility="collapsed")
-                                if new_note != g['rating']:
-                                    update_rating_db(st.session_state.user_email, app_mode, g['title'], new_note)
-                                    st.rerun()
-                            with c_btn3:
-                                if st.button("🗑️", key=f"lib_del_{idx}_{g['title']}"):
-                                    delete_item_db(st.session_state.user_email, app_mode, g['title'])
-                                    st.rerun()
+                        with lib_cols[idx % 3]:
+                            library_card(idx, g['title'], lib_imgs[g['title']], app_mode)
+                
+                if page_count > 1:
+                    c_prev, c_page, c_next = st.columns([1, 2, 1])
+                    with c_prev:
+                        if st.button("◀", key="lib_prev", disabled=st.session_state.lib_page == 0, use_container_width=True):
+                            st.session_state.lib_page -= 1
+                            st.rerun()
+                    with c_page:
+                        st.markdown(f'<p style="text-align:center; color:#94A3B8; font-weight:700; margin-top:12px;">Page {st.session_state.lib_page + 1} / {page_count} · {total_matches} titres</p>', unsafe_allow_html=True)
+                    with c_next:
+                        if st.button("▶", key="lib_next", disabled=st.session_state.lib_page >= page_count - 1, use_container_width=True):
+                            st.session_state.lib_page += 1
+                            st.rerun()
 
 # --- POINT D'ENTRÉE SÉCURISÉ (AIRBAG V2 - DÉFIBRILLATEUR) ---
 if __name__ == "__main__":
     try:
-        main()
+        with request_trace():
+            main()
     except Exception as e:
         # Si ça plante (Erreur 500 ou coupure net), on force le navigateur à recharger
         print(f"CRASH DÉTECTÉ : {e}")
@@ -0,0 +1,192 @@
+"""Banc d'essai hors ligne : rejoue les parcours principaux de l'app avec AppTest.
+
+Supabase, Gemini et les API de visuels sont remplacés par les doublures de
+bench/stubs.py (latence injectée, réponses tirées de bench/fixtures/). Pour
+chaque scénario on mesure l'action utilisateur seule, après une préparation non
+chronométrée : temps réel, premier affichage de la session, appels sortants par
+service et exécutions du script.
+
+    python bench/run_bench.py
+    python bench/run_bench.py --scenario reco_cold --repeat 5 --gemini-latency 1.5
+    python bench/run_bench.py --json bench_output.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(os.path.dirname(BENCH_DIR), "app.py")
+sys.path.insert(0, BENCH_DIR)
+
+import stubs  # noqa: E402  (doit précéder tout import de l'app)
+
+BENCH_EMAIL = "bench@shortlist.local"
+
+
+def search(at, query):
+    at.text_input(key="main_search_input").set_value(query)
+    at.button(key="search_btn").click()
+
+
+def login(at):
+    at.sidebar.text_input(key="sidebar_mail_input").set_value(BENCH_EMAIL)
+    at.sidebar.button(key="sidebar_login_btn").click()
+
+
+def state(at, key, default=None):
+    return at.session_state[key] if key in at.session_state else default
+
+
+# Vérifications du résultat : None si le parcours a abouti, sinon la raison de l'échec
+def three_recos(at):
+    recos = state(at, "current_recos") or []
+    return None if len(recos) == 3 else f"{len(recos)} recommandation(s) affichée(s) au lieu de 3"
+
+
+def everywhere_rows(at):
+    results = state(at, "everywhere_results") or {}
+    return None if any(results.values()) else "aucun résultat dans les catégories"
+
+
+def library_shown(at):
+    return None if any(b.key == "lib_next" for b in at.button) else "bibliothèque non affichée"
+
+
+def next_page(at):
+    return None if state(at, "lib_page") == 1 else f"page {state(at, 'lib_page')} au lieu de 1"
+
+
+# Chaque scénario : (préparation non mesurée, action mesurée, vérification). Toutes reçoivent
+# l'AppTest. Sans préparation (None), la mesure porte sur la toute première exécution du script.
+SCENARIOS = {
+    "cold_start": (
+        None,
+        lambda at: None,
+        lambda at: None,
+    ),
+    "reco_cold": (
+        lambda at: None,
+        lambda at: search(at, "Hollow Knight"),
+        three_recos,
+    ),
+    "reco_repeat": (
+        lambda at: (search(at, "Hollow Knight"), at.run()),
+        lambda at: search(at, "Hollow Knight"),
+        three_recos,
+    ),
+    "search_everywhere": (
+        lambda at: (at.toggle(key="search_everywhere").set_value(True), at.run()),
+        lambda at: search(at, "Dark"),
+        everywhere_rows,
+    ),
+    "reco_logged_in": (
+        lambda at: (login(at), at.run()),
+        lambda at: search(at, "jeu d'exploration contemplatif"),
+        three_recos,
+    ),
+    "reject_replace": (
+        lambda at: (search(at, "Celeste"), at.run()),
+        lambda at: at.button(key="rej_0").click(),
+        three_recos,
+    ),
+    "surprise": (
+        lambda at: at.run(),
+        lambda at: at.button(key="surprise_btn").click(),
+        three_recos,
+    ),
+    "library_render": (
+        lambda at: (login(at), at.run()),
+        lambda at: None,
+        library_shown,
+    ),
+    "library_next_page": (
+        lambda at: (login(at), at.run()),
+        lambda at: at.button(key="lib_next").click(),
+        next_page,
+    ),
+}
+
+
+def run_once(name, args):
+    """Une répétition dans un état vierge : caches locaux, singletons et tables réinitialisés"""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    data_dir = tempfile.mkdtemp(prefix="shortlist-bench-")
+    os.environ["SHORTLIST_DATA_DIR"] = data_dir
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    stubs.SUPABASE.tables.clear()
+    stubs.SUPABASE.seed_library(BENCH_EMAIL, args.library_size)
+    try:
+        setup, action, check = SCENARIOS[name]
+        at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+        if setup:
+            at.run()
+            setup(at)
+            time.sleep(args.settle)  # laisse finir les tâches de fond (recharges, écritures différées)
+        stubs.reset_counters()
+        started = time.perf_counter()
+        action(at)
+        at.run()
+        wall = time.perf_counter() - started
+        calls, reruns = stubs.snapshot()
+        # Un parcours cassé peut être rapide : une mesure ne compte que si le résultat est là
+        if at.exception:
+            raise RuntimeError(f"{name} : {at.exception[0].value}")
+        if at.error:
+            raise RuntimeError(f"{name} : erreur affichée « {at.error[0].value} »")
+        failure = check(at)
+        if failure:
+            raise RuntimeError(f"{name} : {failure}")
+        return {
+            "wall_ms": 1000 * wall,
+            "first_paint_ms": at.session_state["first_paint_ms"] if "first_paint_ms" in at.session_state else None,
+            "reruns": reruns,
+            **{s: calls.get(s, 0) for s in ("supabase", "gemini", "http")},
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="à répéter ; tous par défaut")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--gemini-latency", type=float, default=stubs.LATENCY["gemini_first_token"], help="premier jeton (s)")
+    parser.add_argument("--supabase-latency", type=float, default=stubs.LATENCY["supabase"])
+    parser.add_argument("--http-latency", type=float, default=stubs.LATENCY["http"])
+    parser.add_argument("--library-size", type=int, default=150)
+    parser.add_argument("--settle", type=float, default=1.0, help="pause après la préparation (s)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--record", action="store_true", help="interroge les vraies API de visuels et enregistre leurs réponses")
+    parser.add_argument("--json", help="écrit aussi les résultats détaillés dans ce fichier")
+    args = parser.parse_args()
+
+    stubs.LATENCY.update(gemini_first_token=args.gemini_latency, supabase=args.supabase_latency, http=args.http_latency)
+    for key in ("SUPABASE_URL", "SUPABASE_KEY", "GEMINI_API_KEY", "TMDB_API_KEY"):
+        os.environ.setdefault(key, "bench")
+    stubs.install(record=args.record)
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")  # AppTest tourne sans runtime : avertissements sans intérêt ici
+
+    results = {}
+    print(f"{'scénario':<20}{'temps (ms)':>12}{'1er affichage':>14}{'supabase':>10}{'gemini':>8}{'http':>6}{'reruns':>8}")
+    for name in args.scenario or SCENARIOS:
+        runs = [run_once(name, args) for _ in range(args.repeat)]
+        results[name] = runs
+        median = {k: statistics.median(r[k] or 0 for r in runs) for k in runs[0]}
+        print(f"{name:<20}{median['wall_ms']:>12.0f}{median['first_paint_ms']:>14.0f}{median['supabase']:>10g}{median['gemini']:>8g}{median['http']:>6g}{median['reruns']:>8g}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"latency": stubs.LATENCY, "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
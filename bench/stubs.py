@@ -0,0 +1,369 @@
+"""Doublures locales de Supabase, Gemini et des API de visuels pour le banc d'essai.
+
+`install()` doit être appelé avant le premier lancement de l'app : les modules
+`supabase` et `google.generativeai` sont remplacés dans sys.modules et les requêtes
+HTTP sont servies depuis bench/fixtures/ (aucun accès réseau). Chaque doublure
+attend la latence configurée, pour reproduire le coût réel d'un appel.
+"""
+import asyncio
+import collections
+import functools
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import types
+import urllib.parse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+RECORDED_DIR = os.path.join(FIXTURES_DIR, "recorded")
+
+# Latences injectées (secondes), modifiables par le lanceur
+LATENCY = {
+    "supabase": 0.04,
+    "gemini_first_token": 0.8,
+    "gemini_per_chunk": 0.03,
+    "gemini_embed": 0.1,
+    "http": 0.15,
+}
+
+CALLS = collections.Counter()   # appels sortants par service
+RERUNS = collections.Counter()  # exécutions du script (une par passage dans set_page_config)
+_lock = threading.Lock()
+
+
+def count(service):
+    with _lock:
+        CALLS[service] += 1
+
+
+def reset_counters():
+    with _lock:
+        CALLS.clear()
+        RERUNS.clear()
+
+
+def snapshot():
+    with _lock:
+        return dict(CALLS), RERUNS["script"]
+
+
+# --- SUPABASE (TABLES EN MÉMOIRE) ---
+
+class Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class Query:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.op, self.payload = "select", None
+        self.filters = []
+
+    def select(self, columns="*"):
+        self.op = "select"
+        return self
+
+    def insert(self, payload):
+        self.op, self.payload = "insert", payload
+        return self
+
+    def update(self, payload):
+        self.op, self.payload = "update", payload
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda r: r.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda r: str(r.get(column, "")) > str(value))
+        return self
+
+    def execute(self):
+        count("supabase")
+        time.sleep(LATENCY["supabase"])
+        with self.db.lock:
+            rows = self.db.tables.setdefault(self.table, [])
+            if self.op == "insert":
+                new = self.payload if isinstance(self.payload, list) else [self.payload]
+                for row in new:
+                    rows.append({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "is_favorite": False, "rating": 0, **row})
+                return Result(new)
+            matched = [r for r in rows if all(f(r) for f in self.filters)]
+            if self.op == "update":
+                for r in matched:
+                    r.update(self.payload)
+                return Result(matched)
+            if self.op == "delete":
+                for r in matched:
+                    rows.remove(r)
+                return Result(matched)
+            return Result([dict(r) for r in matched])
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+
+    def table(self, name):
+        return Query(self, name)
+
+    def seed_library(self, email, size):
+        """Bibliothèque de jeux de `size` titres pour l'utilisateur `email`. Les titres portent tous
+        un suffixe que le Catalogue ne produit jamais : les recommandations rejouées ne sont pas
+        déjà dans la bibliothèque (et donc pas écartées par les exclusions)."""
+        works = load_json("gemini.json")["🎮 Jeux Vidéo"]
+        rows = []
+        for i in range(size):
+            work = works[i % len(works)]
+            rows.append({
+                "user_email": email, "game_title": f"{work['titre']} Collection {i // len(works) + 1}", "game_studio": work["auteur"],
+                "rating": i % 6, "is_favorite": i % 7 == 0, "created_at": f"2026-01-01T00:00:{i % 60:02d}",
+            })
+        with self.lock:
+            self.tables["user_library"] = rows
+
+
+SUPABASE = FakeSupabase()
+
+
+# --- GEMINI (RÉPONSES REJOUÉES DEPUIS LES FIXTURES) ---
+
+class Catalogue:
+    """Distribue les œuvres des fixtures sans jamais resservir deux fois le même titre"""
+
+    def __init__(self):
+        self.works = load_json("gemini.json")
+        self.cursors = collections.defaultdict(itertools.count)
+        self.lock = threading.Lock()
+
+    def take(self, mode, n):
+        works = self.works.get(mode) or self.works["🎮 Jeux Vidéo"]
+        out = []
+        with self.lock:
+            for _ in range(n):
+                i = next(self.cursors[mode])
+                work = dict(works[i % len(works)])
+                if i >= len(works):
+                    work["titre"] += f" Chroniques {i // len(works)}"
+                out.append(work)
+        return out
+
+
+CATALOGUE = None
+
+
+def prompt_mode(prompt):
+    for mode in CATALOGUE.works:
+        if mode.upper() in prompt or mode in prompt:
+            return mode
+    return "🎮 Jeux Vidéo"
+
+
+def answer(prompt):
+    """Réponse JSON plausible selon le type de prompt (génération, re-classement, réserve...)"""
+    if "résumé" in prompt.lower():
+        return "Un résumé court et accrocheur."
+    if "CANDIDATS" in prompt:
+        return json.dumps([{"id": n, "badge": "Pépite", "desc": "Le choix parfait."} for n in (2, 1, 4)])
+    match = re.search(r"Propose (\d+) pépites|avec (\d+) œuvre", prompt)
+    if match:
+        n = int(match.group(1) or match.group(2))
+    elif "1 SEULE" in prompt:
+        return json.dumps(CATALOGUE.take(prompt_mode(prompt), 1)[0], ensure_ascii=False)
+    else:
+        n = 3
+    return json.dumps(CATALOGUE.take(prompt_mode(prompt), n), ensure_ascii=False)
+
+
+class Usage:
+    def __init__(self, prompt, text):
+        self.prompt_token_count = len(prompt) // 4
+        self.candidates_token_count = len(text) // 4
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+
+class Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class Response:
+    def __init__(self, prompt, text):
+        self.text = text
+        self.usage_metadata = Usage(prompt, text)
+
+    def __iter__(self):
+        for i in range(0, len(self.text), 40):
+            time.sleep(LATENCY["gemini_per_chunk"])
+            yield Chunk(self.text[i:i + 40])
+
+
+class AsyncResponse(Response):
+    def __aiter__(self):
+        async def chunks():
+            for i in range(0, len(self.text), 40):
+                await asyncio.sleep(LATENCY["gemini_per_chunk"])
+                yield Chunk(self.text[i:i + 40])
+        return chunks()
+
+
+class FakeModel:
+    def __init__(self, model_name=None, generation_config=None, **kwargs):
+        self.model_name = model_name
+        self.generation_config = generation_config
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        count("gemini")
+        time.sleep(LATENCY["gemini_first_token"])
+        return Response(prompt, answer(prompt))
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        count("gemini")
+        await asyncio.sleep(LATENCY["gemini_first_token"])
+        return AsyncResponse(prompt, answer(prompt))
+
+
+def embed_content(model, content, **kwargs):
+    count("gemini")
+    time.sleep(LATENCY["gemini_embed"])
+    return {"embedding": [float(ord(c) % 7) for c in (content + " " * 32)[:32]]}
+
+
+# --- API DE VISUELS (RAWG, TMDB, ITUNES, GOOGLE BOOKS, JIKAN) ---
+
+def load_json(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def provider_query(url):
+    params = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    for key in ("search", "query", "term", "q", "filter[text]"):
+        if key in params:
+            return params[key][0]
+    return ""
+
+
+def fill_template(value, query):
+    if isinstance(value, dict):
+        return {k: fill_template(v, query) for k, v in value.items()}
+    if isinstance(value, list):
+        return [fill_template(v, query) for v in value]
+    if isinstance(value, str):
+        slug = re.sub(r"[^a-z0-9]+", "-", query.lower()).strip("-")
+        return value.replace("{query}", query).replace("{slug}", slug)
+    return value
+
+
+IMAGE_HOSTS = {"books.google.com", "placehold.co"}
+
+
+def is_image_url(url):
+    parts = urllib.parse.urlsplit(url)
+    return parts.hostname in IMAGE_HOSTS or re.search(r"\.(jpe?g|png|webp)$", parts.path) is not None
+
+
+@functools.lru_cache(maxsize=1)
+def poster_bytes():
+    """Affiche 600x900 au grain photographique (poids comparable à un vrai visuel)"""
+    import io
+    from PIL import Image
+    out = io.BytesIO()
+    Image.effect_noise((600, 900), 64).convert("RGB").save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def image_response(request):
+    import requests
+    response = requests.Response()
+    response.status_code = 200
+    response.url = request.url
+    response.request = request
+    response.headers["Content-Type"] = "image/jpeg"
+    response._content = poster_bytes()
+    return response
+
+
+def recorded_path(host):
+    return os.path.join(RECORDED_DIR, f"{host}.json")
+
+
+def install(record=False):
+    """Branche les doublures. Avec `record`, les appels aux API de visuels partent
+    réellement et leurs réponses sont enregistrées dans fixtures/recorded/ pour être rejouées."""
+    global CATALOGUE
+    CATALOGUE = Catalogue()
+
+    import streamlit
+    import google  # paquet namespace : seul google.generativeai est remplacé (protobuf reste intact)
+
+    supabase = types.ModuleType("supabase")
+    supabase.create_client = lambda url, key: SUPABASE
+    supabase.Client = FakeSupabase
+    sys.modules["supabase"] = supabase
+
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = FakeModel
+    genai.embed_content = embed_content
+    google.generativeai = genai
+    sys.modules["google.generativeai"] = genai
+
+    set_page_config = streamlit.set_page_config
+
+    def counting_set_page_config(*args, **kwargs):
+        with _lock:
+            RERUNS["script"] += 1
+        return set_page_config(*args, **kwargs)
+
+    streamlit.set_page_config = counting_set_page_config
+
+    import requests
+    import requests.adapters
+    templates = load_json("providers.json")
+    real_send = requests.adapters.HTTPAdapter.send
+    recorded = {}
+
+    def send(adapter, request, **kwargs):
+        count("http")
+        host = urllib.parse.urlsplit(request.url).hostname
+        if not record and is_image_url(request.url):
+            time.sleep(LATENCY["http"])
+            return image_response(request)
+        query = provider_query(request.url)
+        if host not in recorded:
+            path = recorded_path(host)
+            recorded[host] = load_json(path) if os.path.exists(path) else {}
+        if record:
+            response = real_send(adapter, request, **kwargs)
+            if response.ok:
+                recorded[host][query] = response.json()
+                os.makedirs(RECORDED_DIR, exist_ok=True)
+                with open(recorded_path(host), "w", encoding="utf-8") as f:
+                    json.dump(recorded[host], f, ensure_ascii=False, indent=1)
+            return response
+        time.sleep(LATENCY["http"])
+        if query in recorded[host]:
+            body = recorded[host][query]
+        else:
+            body = fill_template(templates.get(host, {}), query)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(body).encode()
+        return response
+
+    requests.adapters.HTTPAdapter.send = send
@@ -0,0 +1,9 @@
+-- Index de la bibliothèque (chargement du profil et écritures différées)
+-- À exécuter une fois dans l'éditeur SQL de Supabase.
+
+-- Chargement du profil (filtre par utilisateur) et mises à jour / suppressions par titre
+create index if not exists user_library_email_title
+    on user_library (user_email, game_title);
+
+create index if not exists user_media_email_category_title
+    on user_media (user_email, category, title);